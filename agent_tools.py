@@ -1,34 +1,108 @@
-from ragflow import Ragflow
+from ragflow import Ragflow, merge_chunks, split_dataset_ids
+from retrieval_cache import retrieval_cache
 from langchain_core.tools import tool
+from langgraph.prebuilt import InjectedState
+from resilience import breaker
+from logger import logger
+from logger_config import capped
+import asyncio
 import os
 
-from typing import Dict, Any
-from search_web import search_web
+from typing import Dict, Any, Annotated
+from search_web import search_web_results
+from search_cache import cache_key, search_cache, ttl_until_rollover
+from search_aggregator import aggregate_results, build_aggregated_context
+from langchain_tavily import TavilySearch
 from datetime import datetime
-ragflow = Ragflow() 
+ragflow = Ragflow()
+_tavily = TavilySearch(api_key=os.getenv("TAVILY_API_KEY"))
 
-@tool
-async def search_web_using_bocha(query: str, topk: int = 5) -> str:
-    """Search the web for information about the query
-    Args:
-        query: the query to search the web.
-        topk: the number of top results to return.
-    Returns:
-        The results of the search.
-    """
-    return await search_web(query, topk, trigger_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+async def _tavily_search(query: str) -> dict:
+    result = await _tavily.ainvoke({"query": query})
+    # TavilySearch reports API errors as {"error": ...} instead of raising
+    if isinstance(result, dict) and "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+async def tavily_results(query: str) -> dict:
+    """Raw Tavily response, cached for the rest of the day."""
+    # Tavily searches up to now, so its window is the current day
+    today = datetime.now().strftime("%Y%m%d")
+    ttl = ttl_until_rollover(today)
+    key = cache_key("tavily", query, _tavily.max_results, today, today)
+    cached = await search_cache.get_first([key], ttl)
+    if cached is not None:
+        return cached
+    try:
+        result = await breaker("tavily").call(_tavily_search, query)
+    except Exception as e:  # includes CircuitOpenError
+        logger.warning("[tavily_results] search failed: %r", e)
+        return {"error": str(e) or type(e).__name__}
+    if isinstance(result, dict) and result.get("results"):
+        await search_cache.set(key, result, ttl)
+    return result
+
+async def rag_chunks(query: str, dataset_id: str, top_k: int = 5) -> list:
+    """Ranked chunks of one or several (comma separated) datasets, cached per dataset."""
+    ds_ids = split_dataset_ids(dataset_id)
+    chunk_lists = await asyncio.gather(*(retrieval_cache.get(ds_id, query, top_k) for ds_id in ds_ids))
+    missing = [ds_id for ds_id, chunks in zip(ds_ids, chunk_lists) if chunks is None]
+    if missing:
+        logger.debug("[rag_chunks] retrieving %s for: %s", missing, capped(query, 200))
+        # all uncached datasets are queried concurrently
+        fetched = await asyncio.gather(*(ragflow.retrieve(ds_id, query, top_k) for ds_id in missing))
+        for ds_id, chunks in zip(missing, fetched):
+            if chunks:
+                await retrieval_cache.set(ds_id, query, top_k, chunks)
+        fetched_by_id = dict(zip(missing, fetched))
+        chunk_lists = [fetched_by_id[ds_id] if chunks is None else chunks for ds_id, chunks in zip(ds_ids, chunk_lists)]
+    else:
+        logger.debug("[rag_chunks] cache hit %s for: %s", ds_ids, capped(query, 200))
+    return merge_chunks(chunk_lists, top_k)
+
+async def _search_rag(query: str, dataset_id: str) -> list:
+    return [
+        {"source": "knowledge_base", "title": chunk.get("document", ""), "url": "", "snippet": chunk["content"], "time": ""}
+        for chunk in await rag_chunks(query, dataset_id)
+    ]
+
+async def _search_web(query: str) -> list:
+    results = await search_web_results(query, 5, trigger_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    return [dict(r, source="web") for r in results]
+
+async def _search_tavily(query: str) -> list:
+    result = await tavily_results(query)
+    if not isinstance(result, dict):
+        return []
+    return [
+        {"source": "web", "title": r.get("title", ""), "url": r.get("url", ""), "snippet": r.get("content", ""), "time": ""}
+        for r in result.get("results", [])
+    ]
 
 @tool
-async def get_rag_data(query: str, dataset_id: str) -> str:
-    """Search the RAG database for information about the query
+async def search_all(
+    query: str,
+    dataset_id: Annotated[str, InjectedState("dataset_id")] = "",
+    do_web_search: Annotated[bool, InjectedState("do_web_search")] = True,
+) -> str:
+    """Search the knowledge base and the web for information about the query, all sources in one call.
     Args:
-        query: the query to search the RAG database.
-        dataset_id: the dataset id to search the RAG database. 
+        query: the query to search, simple specific keywords.
     Returns:
-        The results of the search.
+        Deduplicated search results from all sources, best first.
     """
-    print('ragflow retrieve data', dataset_id, query)
-    results = ragflow.search_data(ds_id=dataset_id, top_k=5, question=query)
-    print(f"ragflow results: {results}")
-    return "\n".join(results)
-
+    searches = []
+    if dataset_id:
+        searches.append(_search_rag(query, dataset_id))
+    if do_web_search:
+        searches.append(_search_web(query))
+        if os.getenv("TAVILY_API_KEY"):
+            searches.append(_search_tavily(query))
+    result_lists = []
+    for results in await asyncio.gather(*searches, return_exceptions=True):
+        if isinstance(results, Exception):
+            logger.warning("[search_all] source failed: %r", results)
+            continue
+        result_lists.append(results)
+    context = build_aggregated_context(aggregate_results(result_lists))
+    return context or "No results found."
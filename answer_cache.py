@@ -0,0 +1,256 @@
+"""
+Cache of final answers for repeated questions, scoped per (dataset_id, mode) where mode is web or knowledge base only.
+A question is looked up by its normalized text first, then by embedding similarity against the questions cached in
+the same scope. Answers depend on the conversation and on the user facts in the prompt, so by default only the first turn of a
+session of a user without facts is served from or stored into the cache, and users listed in ANSWER_CACHE_BYPASS_USERS are never served from it.
+
+The embedder is pluggable: "none" (default) keeps exact matches only; "sentence-transformers/<model>" loads a
+local CPU model; "hashing" is a dependency-free character n-gram embedder that only catches the same words in a
+different order or wording that differs by spacing, since n-gram overlap cannot tell 手机 from 耳机.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+import zlib
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from bounded_cache import BoundedCache
+from logger import logger
+from retrieval_cache import normalize_question
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ANSWER_CACHE_EMBEDDER = os.getenv("ANSWER_CACHE_EMBEDDER", "none")
+# cosine similarity from which a cached question counts as the same question
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+ANSWER_CACHE_FIRST_TURN_ONLY = os.getenv("ANSWER_CACHE_FIRST_TURN_ONLY", "1") == "1"
+ANSWER_CACHE_BYPASS_USERS = {u.strip() for u in os.getenv("ANSWER_CACHE_BYPASS_USERS", "").split(",") if u.strip()}
+# seconds between sweeps of expired answers that were never read again
+ANSWER_CACHE_PURGE_INTERVAL = float(os.getenv("ANSWER_CACHE_PURGE_INTERVAL", "60"))
+
+Embedder = Callable[[List[str]], np.ndarray]
+
+_NUMBERS = re.compile(r"\d+(?:\.\d+)?")
+# words, numbers and single CJK characters
+_TERMS = re.compile(r"[a-z]+|\d+(?:\.\d+)?|[\u3400-\u9fff]")
+
+
+def hashing_embedder(texts: List[str], dim: int = 512) -> np.ndarray:
+    """L2-normalized bag of hashed character 1- and 2-grams; works for Chinese without segmentation."""
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+        for gram in grams:
+            vectors[row, zlib.crc32(gram.encode("utf-8")) % dim] += 1.0
+        norm = np.linalg.norm(vectors[row])
+        if norm:
+            vectors[row] /= norm
+    return vectors
+
+
+def load_embedder(name: str = ANSWER_CACHE_EMBEDDER) -> Optional[Embedder]:
+    if name == "none":
+        return None
+    if name == "hashing":
+        return hashing_embedder
+    if name.startswith("sentence-transformers/"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            logger.warning("[AnswerCache] sentence-transformers is not installed, using the hashing embedder")
+            return hashing_embedder
+        model = SentenceTransformer(name.split("/", 1)[1], device="cpu")
+        return lambda texts: model.encode(texts, normalize_embeddings=True)
+    raise ValueError(f"unknown ANSWER_CACHE_EMBEDDER: {name}")
+
+
+class _ScopeIndex:
+    """Question vectors of one scope in a preallocated matrix; a removed row is filled with the last one."""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.digests = []
+        self.row_of = {}
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def add(self, digest: str, vector: np.ndarray):
+        row = self.row_of.get(digest)
+        if row is None:
+            row = len(self.digests)
+            if row == len(self.vectors):
+                grown = np.empty((2 * len(self.vectors), self.vectors.shape[1]), dtype=np.float32)
+                grown[:row] = self.vectors
+                self.vectors = grown
+            self.digests.append(digest)
+            self.row_of[digest] = row
+        self.vectors[row] = vector
+
+    def remove(self, digest: str):
+        row = self.row_of.pop(digest, None)
+        if row is None:
+            return
+        last = self.digests.pop()
+        if last != digest:
+            self.vectors[row] = self.vectors[len(self.digests)]
+            self.digests[row] = last
+            self.row_of[last] = row
+        if len(self.vectors) > 64 and len(self.digests) <= len(self.vectors) // 4:
+            self.vectors = self.vectors[:len(self.vectors) // 2].copy()
+
+    def search(self, vector: np.ndarray, threshold: float) -> list:
+        """(similarity, digest) of the rows scoring at least threshold, best first."""
+        scores = self.vectors[:len(self.digests)] @ vector
+        rows = np.flatnonzero(scores >= threshold)
+        return [(float(scores[r]), self.digests[r]) for r in rows[np.argsort(-scores[rows])]]
+
+
+class AnswerCache:
+    """
+    Answer cache with exact and semantic lookup.
+
+    Args:
+        embedder (Embedder, optional): Maps questions to L2-normalized vectors, None for exact matches only.
+        similarity (float): Minimum cosine similarity of a semantic match.
+        ttl (float): Seconds an answer is served.
+        max_entries (int): Maximum number of answers, and so of indexed vectors, across all scopes.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None, similarity: float = ANSWER_CACHE_SIMILARITY,
+                 ttl: float = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.embedder = embedder
+        self.similarity = similarity
+        # the index follows the answers: a vector goes when its answer is evicted, expires or is invalidated
+        self.answers = BoundedCache(max_entries=max_entries, max_bytes=ANSWER_CACHE_MAX_BYTES, ttl=ttl,
+                                    on_remove=self._unindex)
+        self._index = {}  # scope -> _ScopeIndex
+        self._purged_at = time.monotonic()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypassed = {}  # reason -> requests that did not use the cache
+
+    @staticmethod
+    def scope(dataset_id: str, do_web_search: bool) -> tuple:
+        return (dataset_id or "", "web" if do_web_search else "kb")
+
+    @staticmethod
+    def _digest(question: str) -> str:
+        return hashlib.sha1(question.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _numbers(question: str) -> list:
+        # model numbers, sizes and prices: "iphone 15" and "iphone 16" embed alike but are different questions
+        return sorted(_NUMBERS.findall(question))
+
+    @staticmethod
+    def _terms(question: str) -> set:
+        return set(_TERMS.findall(question))
+
+    def _unindex(self, key: tuple):
+        scope, digest = key
+        index = self._index.get(scope)
+        if index is None:
+            return
+        index.remove(digest)
+        if not index:
+            del self._index[scope]
+
+    async def _embed(self, question: str) -> np.ndarray:
+        if self.embedder is hashing_embedder:
+            return self.embedder([question.replace(" ", "")])[0]
+        # model embedders are CPU bound
+        return (await asyncio.to_thread(self.embedder, [question]))[0]
+
+    def record_bypass(self, reason: str):
+        self.bypassed[reason] = self.bypassed.get(reason, 0) + 1
+
+    def bypass(self, user_id: str, session: dict, user_facts: str = "") -> Optional[str]:
+        """Why this request must not use the cache, None if it may. A bypass is counted under its reason."""
+        if not ANSWER_CACHE_ENABLED:
+            reason = "disabled"
+        elif user_id in ANSWER_CACHE_BYPASS_USERS:
+            reason = "user"
+        elif user_facts:
+            # the facts are in the prompt, so the answer is tailored to this user
+            reason = "user-facts"
+        elif ANSWER_CACHE_FIRST_TURN_ONLY and (session.get("summary") or session.get("history")):
+            reason = "follow-up"
+        else:
+            return None
+        self.record_bypass(reason)
+        return reason
+
+    async def lookup(self, query: str, dataset_id: str, do_web_search: bool) -> Optional[dict]:
+        """{"answer", "match": "exact" or "semantic", "similarity"} of a cached answer, or None."""
+        question = normalize_question(query)
+        scope = self.scope(dataset_id, do_web_search)
+        entry = self.answers.get((scope, self._digest(question)))
+        if entry is not None:
+            self.exact_hits += 1
+            return {"answer": entry["answer"], "match": "exact", "similarity": 1.0}
+
+        index = self._index.get(scope)
+        if self.embedder is not None and index:
+            numbers = self._numbers(question)
+            # candidates are collected first: reading an expired answer removes its row and moves another
+            for score, digest in index.search(await self._embed(question), self.similarity):
+                entry = self.answers.get((scope, digest), count=False)
+                if entry is None:
+                    continue
+                if self._numbers(entry["question"]) != numbers:
+                    continue
+                # a character n-gram match is only trusted when no word or character differs between the questions
+                if self.embedder is hashing_embedder and self._terms(entry["question"]) != self._terms(question):
+                    continue
+                self.semantic_hits += 1
+                return {"answer": entry["answer"], "match": "semantic", "similarity": score}
+        self.misses += 1
+        return None
+
+    async def store(self, query: str, dataset_id: str, do_web_search: bool, answer: str):
+        question = normalize_question(query)
+        scope = self.scope(dataset_id, do_web_search)
+        digest = self._digest(question)
+        if time.monotonic() - self._purged_at > ANSWER_CACHE_PURGE_INTERVAL:
+            self._purged_at = time.monotonic()
+            self.answers.purge_expired()
+        # embedded before the answer is set, so the answer cannot be evicted before its vector is indexed
+        vector = await self._embed(question) if self.embedder is not None else None
+        self.answers.set((scope, digest), {"question": question, "answer": answer})
+        if vector is not None:
+            if scope not in self._index:
+                self._index[scope] = _ScopeIndex(len(vector))
+            self._index[scope].add(digest, vector)
+
+    def invalidate_dataset(self, dataset_id: str) -> int:
+        """Drop the answers built on a dataset, in both modes and together with other datasets."""
+        def uses_dataset(scope: tuple) -> bool:
+            return dataset_id in [ds_id.strip() for ds_id in scope[0].split(",")]
+
+        return self.answers.pop_where(lambda key: uses_dataset(key[0]))
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self.answers),
+            "bytes": self.answers.bytes,
+            "vectors": sum(len(index) for index in self._index.values()),
+            "scopes": len(self._index),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "bypassed": sum(self.bypassed.values()),
+            "bypassed_by_reason": dict(self.bypassed),
+        }
+
+
+answer_cache = AnswerCache(embedder=load_embedder())
@@ -0,0 +1,125 @@
+"""
+Benchmark the per-request cost of the /query/ event pipeline, offline.
+
+events:  chat_app.astream_events(version="v2"), filtered the way main.py used to (every runnable, tool and model
+         call of the graph is reported, then thrown away)
+modes:   chat_app.astream(stream_mode=["messages", "updates"]), filtered like graph_abs.run_chat_stream
+
+The graph has the shape of the chat graph (agent -> tools -> agent -> END) with a fake streaming model and a fake
+search tool, so only the pipeline overhead is measured. CPU time is measured without tracing, allocations in a
+second pass under tracemalloc.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_event_pipeline --requests 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+from typing import Annotated, TypedDict
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+from langgraph.graph import END, START, StateGraph, add_messages
+from langgraph.prebuilt import ToolNode
+
+
+@tool
+async def search_all(query: str) -> str:
+    """Fake aggregated search."""
+    return "<search_result>" + "result text " * 300 + "</search_result>"
+
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+def build_graph(answer_tokens: int):
+    answer = " ".join(f"词{i}" for i in range(answer_tokens))
+
+    async def agent(state: State):
+        if state["messages"][-1].type == "human":
+            return {"messages": AIMessage(content="", tool_calls=[
+                {"name": "search_all", "args": {"query": "耳机"}, "id": "call_1", "type": "tool_call"}])}
+        model = GenericFakeChatModel(messages=iter([AIMessage(content=answer)]))
+        return {"messages": await model.ainvoke(state["messages"])}
+
+    def should_continue(state: State):
+        return "tools" if state["messages"][-1].tool_calls else END
+
+    builder = StateGraph(State)
+    builder.add_node("agent", agent)
+    builder.add_node("tools", ToolNode([search_all]))
+    builder.add_edge(START, "agent")
+    builder.add_conditional_edges("agent", should_continue, {"tools": "tools", END: END})
+    builder.add_edge("tools", "agent")
+    return builder.compile()
+
+
+async def run_events(app) -> int:
+    sent = 0
+    async for event in app.astream_events({"messages": [HumanMessage(content="推荐耳机")]}, version="v2"):
+        if event["event"] == "on_chat_model_stream" and event.get("metadata", {}).get("langgraph_node") == "agent":
+            chunk = event["data"]["chunk"]
+            if chunk.content and not chunk.tool_call_chunks:
+                sent += 1
+        elif event["event"] == "on_chain_end" and not event.get("parent_ids"):
+            event["data"]["output"]["messages"]
+    return sent
+
+
+async def run_modes(app) -> int:
+    sent = 0
+    messages = []
+    async for mode, payload in app.astream({"messages": [HumanMessage(content="推荐耳机")]},
+                                           stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") == "agent" and chunk.content and not getattr(chunk, "tool_call_chunks", None):
+                sent += 1
+        else:
+            for update in payload.values():
+                messages.append(update.get("messages"))
+    return sent
+
+
+async def measure(app, pipeline, n_requests: int) -> dict:
+    cpu = []
+    for _ in range(n_requests):
+        start = time.process_time()
+        await pipeline(app)
+        cpu.append(time.process_time() - start)
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(max(1, n_requests // 10)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        await pipeline(app)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return {"cpu": cpu, "peak": peaks}
+
+
+async def main(n_requests: int, answer_tokens: int):
+    app = build_graph(answer_tokens)
+    assert await run_events(app) == await run_modes(app) == answer_tokens * 2 - 1
+    results = {}
+    for name, pipeline in (("astream_events v2", run_events), ("messages+updates", run_modes)):
+        results[name] = await measure(app, pipeline, n_requests)
+        cpu = sorted(results[name]["cpu"])
+        print(f"{name:<18} cpu mean={statistics.mean(cpu) * 1000:.3f}ms p95={cpu[int(len(cpu) * 0.95) - 1] * 1000:.3f}ms "
+              f"peak alloc mean={statistics.mean(results[name]['peak']) / 1024:.1f}KiB")
+    old, new = results["astream_events v2"], results["messages+updates"]
+    print(f"saved per request: cpu {(statistics.mean(old['cpu']) - statistics.mean(new['cpu'])) * 1000:.3f}ms, "
+          f"peak alloc {(statistics.mean(old['peak']) - statistics.mean(new['peak'])) / 1024:.1f}KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/query/ event pipeline benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Number of simulated /query/ requests")
+    parser.add_argument("--answer-tokens", type=int, default=200, help="Words streamed in the final answer")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.answer_tokens))
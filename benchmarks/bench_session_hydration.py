@@ -0,0 +1,79 @@
+"""
+Benchmark per-request session hydration/persistence against a live Redis.
+
+legacy:    3 sequential GETs to hydrate, 2 SETs to persist (the old graph_abs behaviour)
+pipelined: SessionStore.load_context / SessionStore.set_session, one round trip each
+
+Usage (from the repo root, REDIS_HOST/REDIS_PORT as for the server):
+    python -m benchmarks.bench_session_hydration --requests 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from session_store import SessionStore
+
+
+def _report(name: str, samples: list):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<22} mean={statistics.mean(samples) * 1000:.3f}ms "
+          f"p50={statistics.median(samples) * 1000:.3f}ms p95={p95 * 1000:.3f}ms")
+
+
+async def _legacy_hydrate(client, user_id: str, session_id: str):
+    await client.get(f"chat:summary:{user_id}:{session_id}")
+    await client.get(f"chat:history:{user_id}:{session_id}")
+    await client.get(f"chat:user_fact:{user_id}")
+
+
+async def _legacy_persist(client, user_id: str, session_id: str, summary: str, history: str):
+    await client.set(f"chat:summary:{user_id}:{session_id}", summary)
+    await client.set(f"chat:history:{user_id}:{session_id}", history)
+
+
+async def main(n_requests: int, payload_size: int):
+    store = SessionStore()
+    client = await store._client()
+    if client is None:
+        print("Redis is not reachable, nothing to benchmark.")
+        return
+
+    user_id, session_id = "bench_user", "bench_session"
+    summary, history = "s" * payload_size, "h" * payload_size
+    await client.set(f"chat:user_fact:{user_id}", "f" * payload_size)
+
+    timings = {"legacy hydrate": [], "pipelined hydrate": [], "legacy persist": [], "pipelined persist": []}
+    for _ in range(n_requests):
+        t0 = time.perf_counter()
+        await _legacy_persist(client, user_id, session_id, summary, history)
+        t1 = time.perf_counter()
+        await _legacy_hydrate(client, user_id, session_id)
+        t2 = time.perf_counter()
+        await store.set_session(user_id, session_id, summary, history)
+        t3 = time.perf_counter()
+        await store.load_context(user_id, session_id)
+        t4 = time.perf_counter()
+        timings["legacy persist"].append(t1 - t0)
+        timings["legacy hydrate"].append(t2 - t1)
+        timings["pipelined persist"].append(t3 - t2)
+        timings["pipelined hydrate"].append(t4 - t3)
+
+    for name, samples in timings.items():
+        _report(name, samples)
+    saved = (statistics.mean(timings["legacy hydrate"]) + statistics.mean(timings["legacy persist"])
+             - statistics.mean(timings["pipelined hydrate"]) - statistics.mean(timings["pipelined persist"]))
+    print(f"saved per request: {saved * 1000:.3f}ms")
+
+    await store.delete_session(user_id, session_id)
+    await client.delete(f"chat:user_fact:{user_id}")
+    await store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Session hydration benchmark")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of simulated /query/ requests")
+    parser.add_argument("--payload-size", type=int, default=2000, help="Characters per summary/history/fact value")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.payload_size))
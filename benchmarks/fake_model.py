@@ -0,0 +1,105 @@
+"""
+Fake chat model for offline benchmarks: no network, configurable latency, real streaming.
+
+Bound to tools (as the agent node binds search_all), its first reply in a turn is a tool call on the user's
+question; once the tool results are in, it streams a canned answer token by token. Usage metadata is
+reported so the model router and /metrics see token counts.
+"""
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from context_budget import count_tokens
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Streaming chat model with canned output.
+
+    Args:
+        first_token_latency (float): Seconds before the first chunk, i.e. prompt processing.
+        token_latency (float): Seconds between two streamed tokens.
+        answer_tokens (int): Tokens in a streamed answer.
+        call_tools (bool): Whether a model bound to tools asks for the first tool before answering.
+    """
+
+    first_token_latency: float = 0.3
+    token_latency: float = 0.01
+    answer_tokens: int = 80
+    call_tools: bool = True
+    tool_names: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "FakeChatModel":
+        return self.model_copy(update={"tool_names": [getattr(t, "name", str(t)) for t in tools]})
+
+    def _wants_tool(self, messages: List[BaseMessage]) -> bool:
+        if not (self.call_tools and self.tool_names):
+            return False
+        # one search per turn: after the last question, no tool result yet
+        for message in reversed(messages):
+            if message.type == "tool":
+                return False
+            if message.type == "human":
+                return True
+        return False
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[AIMessageChunk]:
+        input_tokens = sum(count_tokens(str(m.content)) for m in messages)
+        if self._wants_tool(messages):
+            question = next(str(m.content) for m in reversed(messages) if m.type == "human")
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": self.tool_names[0], "args": json.dumps({"query": question}, ensure_ascii=False),
+                                   "id": f"call_{uuid.uuid4().hex[:12]}", "index": 0}],
+                usage_metadata={"input_tokens": input_tokens, "output_tokens": 12, "total_tokens": input_tokens + 12},
+            )
+            return
+        for i in range(self.answer_tokens):
+            usage = None
+            if i == self.answer_tokens - 1:
+                usage = {"input_tokens": input_tokens, "output_tokens": self.answer_tokens,
+                         "total_tokens": input_tokens + self.answer_tokens}
+            yield AIMessageChunk(content=f"词{i} ", usage_metadata=usage)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        message = None
+        async for generation in self._astream(messages, stop):
+            message = generation.message if message is None else message + generation.message
+        return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(message))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        chunks = list(self._chunks(messages))
+        time.sleep(self.first_token_latency + self.token_latency * (len(chunks) - 1))
+        message = chunks[0]
+        for chunk in chunks[1:]:
+            message = message + chunk
+        return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(message))])
+
+
+def fake_models(first_token_latency: float = 0.3, token_latency: float = 0.01, answer_tokens: int = 80) -> tuple:
+    """(strong, fast) pair in the shape of utils.qwen_turbo, for utils.MODEL_PROVIDERS."""
+    strong = FakeChatModel(first_token_latency=first_token_latency, token_latency=token_latency,
+                           answer_tokens=answer_tokens)
+    fast = FakeChatModel(first_token_latency=first_token_latency / 3, token_latency=token_latency / 2,
+                         answer_tokens=answer_tokens // 2)
+    return strong, fast
@@ -0,0 +1,191 @@
+"""
+Load test of /query/ with no network access: starts the stand-ins (benchmarks.stand_ins) and the offline API
+server (benchmarks.serve) as subprocesses on free local ports, drives /query/ at a fixed concurrency and reports
+latency and time to first token percentiles and throughput. With --url an already running server is driven
+instead.
+
+Each worker runs its requests one after another; --turns requests in a row share a session, so follow-up
+turns (summary, history, checkpoint resume) are exercised too.
+
+Usage (from the repo root):
+    python -m benchmarks.load_test --concurrency 16 --requests 400
+    python -m benchmarks.load_test --concurrency 8 --requests 200 --json result.json --max-p95-ms 3000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+QUESTIONS = [
+    "推荐一款降噪耳机",
+    "家用咖啡机怎么选",
+    "适合新手的跑步鞋有哪些",
+    "笔记本电脑续航哪款好",
+    "空气净化器滤网多久换一次",
+    "儿童安全座椅选购要点",
+    "扫地机器人和洗地机哪个好",
+    "露营帐篷推荐",
+]
+
+
+def _percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, int(round(len(samples) * q)) - 1)] if samples else float("nan")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+async def _query(client: httpx.AsyncClient, url: str, params: dict) -> dict:
+    start = time.perf_counter()
+    ttft = None
+    ok = True
+    try:
+        async with client.stream("GET", f"{url}/query/", params=params) as response:
+            if response.status_code != 200:
+                ok = False
+            async for text in response.aiter_text():
+                if text and ttft is None:
+                    ttft = time.perf_counter() - start
+                if "error: " in text:
+                    ok = False
+    except httpx.HTTPError:
+        ok = False
+    return {"ok": ok, "latency": time.perf_counter() - start, "ttft": ttft}
+
+
+async def run_load(url: str, concurrency: int, n_requests: int, turns: int, use_cache: bool, warmup: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(120, connect=5), limits=limits) as client:
+        def params(worker: int, i: int) -> dict:
+            return {
+                "original_query": f"{QUESTIONS[i % len(QUESTIONS)]}（{worker}-{i}）",
+                "dataset_id": "bench-ds",
+                "user_id": f"bench-user-{worker}",
+                "thread_id": f"bench-{worker}-{i // turns}",
+                "do_web_search": "true",
+                "use_cache": str(use_cache).lower(),
+            }
+
+        for i in range(warmup):
+            await _query(client, url, params(-1, i))
+
+        results = []
+        counter = iter(range(n_requests))
+
+        async def worker(worker_id: int):
+            done = 0
+            for _ in counter:
+                results.append(await _query(client, url, params(worker_id, done)))
+                done += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies = [r["latency"] for r in results if r["ok"]]
+    ttfts = [r["ttft"] for r in results if r["ok"] and r["ttft"] is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {f"p{int(q * 100)}": _percentile(latencies, q) * 1000 for q in (0.5, 0.95, 0.99)},
+        "ttft_ms": {f"p{int(q * 100)}": _percentile(ttfts, q) * 1000 for q in (0.5, 0.95, 0.99)},
+    }
+
+
+def _report(result: dict):
+    latency, ttft = result["latency_ms"], result["ttft_ms"]
+    print(f"requests={result['requests']} errors={result['errors']} concurrency={result['concurrency']} "
+          f"time={result['seconds']:.1f}s throughput={result['rps']:.2f} req/s")
+    print(f"latency p50={latency['p50']:.0f}ms p95={latency['p95']:.0f}ms p99={latency['p99']:.0f}ms")
+    print(f"ttft    p50={ttft['p50']:.0f}ms p95={ttft['p95']:.0f}ms p99={ttft['p99']:.0f}ms")
+
+
+def _spawn(module: str, args: list, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable, "-m", module, *map(str, args)], stdout=log, stderr=subprocess.STDOUT,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def main(args):
+    processes = []
+    url = args.url
+    try:
+        if url is None:
+            workdir = tempfile.mkdtemp(prefix="chat-load-")
+            stand_ins = f"http://127.0.0.1:{_free_port()}"
+            port = _free_port()
+            processes.append(_spawn("benchmarks.stand_ins", [
+                "--port", stand_ins.rsplit(":", 1)[1], "--latency-ms", args.dependency_ms,
+            ], os.path.join(workdir, "stand_ins.log")))
+            processes.append(_spawn("benchmarks.serve", [
+                "--port", port, "--stand-ins", stand_ins, "--redis", args.redis, "--workdir", workdir,
+                "--first-token-ms", args.first_token_ms, "--token-ms", args.token_ms,
+                "--answer-tokens", args.answer_tokens,
+            ], os.path.join(workdir, "serve.log")))
+            url = f"http://127.0.0.1:{port}"
+            print(f"stand-ins {stand_ins}, server {url}, logs in {workdir}")
+            await _wait_ready(f"{stand_ins}/health")
+            await _wait_ready(f"{url}/query/stats")
+
+        result = await run_load(url, args.concurrency, args.requests, args.turns, args.use_cache, args.warmup)
+        _report(result)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+    failed = []
+    if result["errors"]:
+        failed.append(f"{result['errors']} failed requests")
+    if args.max_p95_ms and result["latency_ms"]["p95"] > args.max_p95_ms:
+        failed.append(f"p95 latency {result['latency_ms']['p95']:.0f}ms over {args.max_p95_ms:.0f}ms")
+    if failed:
+        sys.exit("; ".join(failed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline /query/ load test")
+    parser.add_argument("--url", default=None, help="Drive this server instead of starting the offline one")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests sent first")
+    parser.add_argument("--turns", type=int, default=1, help="Consecutive requests of a worker sharing a session")
+    parser.add_argument("--use-cache", action="store_true", help="Allow answers from the answer cache")
+    parser.add_argument("--redis", choices=["fake", "local"], default="fake")
+    parser.add_argument("--dependency-ms", type=float, default=80, help="Stand-in response time")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="Fake model latency to the first chunk")
+    parser.add_argument("--token-ms", type=float, default=10, help="Fake model latency between streamed tokens")
+    parser.add_argument("--answer-tokens", type=int, default=80, help="Tokens in a fake answer")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="Exit non-zero when p95 latency is higher")
+    asyncio.run(main(parser.parse_args()))
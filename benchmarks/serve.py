@@ -0,0 +1,69 @@
+"""
+Run the API (main.app) fully offline: the fake chat model for both router roles, Ragflow/Bocha/Serper on the
+local stand-ins, and fakeredis (or a local Redis) for the session store and the shared caches.
+Session, checkpoint and log files go to a temporary directory.
+
+Usage (from the repo root, stand-ins running):
+    python -m benchmarks.serve --port 8191 --stand-ins http://127.0.0.1:9100 --redis fake
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+
+def configure(stand_ins: str, workdir: str):
+    """Point every external dependency at the stand-ins; must run before the app's modules are imported."""
+    os.environ.update({
+        "RAGFLOW_BASE_URL": stand_ins,
+        "BOCHA_URL": f"{stand_ins}/v1/web-search",
+        "SERP_URL": f"{stand_ins}/search",
+        "MODEL_PROVIDER": "fake",
+        "SESSION_DB_PATH": os.path.join(workdir, "session_store.db"),
+        "CHECKPOINT_DB_PATH": os.path.join(workdir, "checkpoints.db"),
+    })
+    for name, value in (("BOCHA_API_KEY", "bench"), ("SERP_API_KEY", "bench"), ("SEARCH_PROVIDERS", "bocha,serper"),
+                        ("LOG_CONSOLE_LEVEL", "WARNING")):
+        os.environ.setdefault(name, value)
+    # the Tavily client needs a key to be built; it is cleared once the app is imported so search_all skips Tavily
+    os.environ["TAVILY_API_KEY"] = "bench"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline API server for benchmarks")
+    parser.add_argument("--port", type=int, default=8191)
+    parser.add_argument("--stand-ins", default="http://127.0.0.1:9100", help="Base URL of benchmarks.stand_ins")
+    parser.add_argument("--redis", choices=["fake", "local"], default="fake",
+                        help="fake: in-process fakeredis; local: the Redis at REDIS_HOST/REDIS_PORT")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="Fake model latency to the first chunk")
+    parser.add_argument("--token-ms", type=float, default=10, help="Fake model latency between streamed tokens")
+    parser.add_argument("--answer-tokens", type=int, default=80, help="Tokens in a fake answer")
+    parser.add_argument("--workdir", default=None, help="Directory for SQLite files, a temporary one by default")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chat-bench-")
+    configure(args.stand_ins.rstrip("/"), workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.chdir(workdir)  # logs/ of logger_config
+
+    import utils
+    from benchmarks.fake_model import fake_models
+    utils.MODEL_PROVIDERS["fake"] = lambda: fake_models(args.first_token_ms / 1000, args.token_ms / 1000,
+                                                         args.answer_tokens)
+
+    if args.redis == "fake":
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("fakeredis is not installed (pip install fakeredis), or run with --redis local")
+        from session_store import session_store
+        session_store._redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+    import uvicorn
+    from main import app
+    os.environ["TAVILY_API_KEY"] = ""
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
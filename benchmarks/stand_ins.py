@@ -0,0 +1,100 @@
+"""
+Local HTTP stand-ins for the external APIs /query/ calls, with configurable latency:
+
+- Ragflow: POST /api/v1/retrieval, GET /api/v1/datasets (point RAGFLOW_BASE_URL at the server)
+- Bocha:   POST /v1/web-search (BOCHA_URL=<server>/v1/web-search)
+- Serper:  POST /search (SERP_URL=<server>/search)
+
+Responses have the shape of the real APIs, with deterministic content derived from the query.
+
+Usage (from the repo root):
+    python -m benchmarks.stand_ins --port 9100 --latency-ms 80
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+
+import uvicorn
+from fastapi import Body, FastAPI, HTTPException
+
+
+def _snippet(query: str, i: int, chars: int) -> str:
+    seed = hashlib.sha1(f"{query}:{i}".encode("utf-8")).hexdigest()
+    text = f"{query} 相关资料 {i}：" + " ".join(seed[j:j + 8] for j in range(0, 40, 8)) + " "
+    return (text * (chars // len(text) + 1))[:chars]
+
+
+def create_app(latency: float = 0.08, jitter: float = 0.25, chunk_chars: int = 400, error_rate: float = 0.0) -> FastAPI:
+    """
+    Args:
+        latency (float): Mean response time in seconds.
+        jitter (float): Relative spread of the response time, uniform in latency * (1 ± jitter).
+        chunk_chars (int): Characters per retrieval chunk or search snippet.
+        error_rate (float): Share of requests answered with HTTP 503.
+    """
+    app = FastAPI()
+    app.state.requests = 0
+
+    async def respond():
+        app.state.requests += 1
+        await asyncio.sleep(latency * random.uniform(1 - jitter, 1 + jitter))
+        if error_rate and random.random() < error_rate:
+            raise HTTPException(status_code=503, detail="stand-in failure")
+
+    @app.post("/api/v1/retrieval")
+    async def ragflow_retrieval(payload: dict = Body(...)):
+        await respond()
+        question = payload.get("question", "")
+        ds_id = (payload.get("dataset_ids") or [""])[0]
+        chunks = [
+            {"id": f"{ds_id}-{i}", "content": _snippet(question, i, chunk_chars), "similarity": round(0.9 - i * 0.05, 3),
+             "dataset_id": ds_id, "document_keyword": f"doc_{i}.pdf"}
+            for i in range(int(payload.get("page_size", 5)))
+        ]
+        return {"code": 0, "data": {"chunks": chunks, "total": len(chunks)}}
+
+    @app.get("/api/v1/datasets")
+    async def ragflow_datasets():
+        await respond()
+        return {"code": 0, "data": [{"name": "bench", "id": "bench-ds", "description": "benchmark dataset"}]}
+
+    @app.post("/v1/web-search")
+    async def bocha_search(payload: dict = Body(...)):
+        await respond()
+        query = payload.get("query", "")
+        pages = [
+            {"name": f"{query} - 结果 {i}", "snippet": _snippet(query, i, chunk_chars),
+             "url": f"https://example.com/{i}", "dateLastCrawled": "2026-01-01T00:00:00Z"}
+            for i in range(int(payload.get("count", 3)))
+        ]
+        return {"code": 200, "data": {"webPages": {"value": pages}}}
+
+    @app.post("/search")
+    async def serper_search(payload: dict = Body(...)):
+        await respond()
+        query = payload.get("q", "")
+        organic = [
+            {"title": f"{query} - result {i}", "snippet": _snippet(query, i, chunk_chars),
+             "link": f"https://example.com/{i}", "date": "Jan 1, 2026"}
+            for i in range(int(payload.get("num", 3)))
+        ]
+        return {"organic": organic}
+
+    @app.get("/health")
+    async def health():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ragflow / Bocha / Serper stand-ins")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=80, help="Mean response time")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Relative spread of the response time")
+    parser.add_argument("--chunk-chars", type=int, default=400, help="Characters per chunk or snippet")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 503")
+    args = parser.parse_args()
+    app = create_app(args.latency_ms / 1000, args.jitter, args.chunk_chars, args.error_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,137 @@
+"""
+Size- and TTL-bounded in-process LRU cache with memory accounting and hit/miss counters.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def approx_sizeof(value: Any) -> int:
+    """Rough deep size in bytes of the str/bytes/dict/list/tuple values we keep in caches."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_sizeof(k) + approx_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(approx_sizeof(v) for v in value)
+    return size
+
+
+class BoundedCache:
+    """
+    LRU cache bounded by entry count, approximate memory and per-entry TTL.
+
+    Args:
+        max_entries (int): Maximum number of entries kept.
+        max_bytes (int): Maximum approximate memory of keys + values, 0 for no limit.
+        ttl (float): Seconds an entry stays valid, 0 for no expiry.
+        sizeof (Callable): Function estimating an entry's memory.
+        on_remove (Callable, optional): Called with the key of every entry that is evicted, expires, is popped or
+            replaced; runs under the cache lock, so it must not call back into the cache.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 0, ttl: float = 0,
+                 sizeof: Callable[[Any], int] = approx_sizeof,
+                 on_remove: Optional[Callable[[Hashable], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._on_remove = on_remove
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, count=False) is not None
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] and entry[1] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        size = self._sizeof(key) + self._sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + ttl if ttl else 0, size)
+            self.bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove every entry whose key matches predicate, return how many were removed."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def purge_expired(self) -> int:
+        """Remove the expired entries that were not read since they expired, return how many were removed."""
+        now = time.monotonic()
+        with self._lock:
+            keys = [k for k, (_, expires_at, _) in self._data.items() if expires_at and expires_at < now]
+            for k in keys:
+                self._remove(k)
+            self.expirations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            if self._on_remove is not None:
+                for key in self._data:
+                    self._on_remove(key)
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, key: Hashable):
+        _, _, size = self._data.pop(key)
+        self.bytes -= size
+        if self._on_remove is not None:
+            self._on_remove(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,267 @@
+"""
+LangGraph checkpointer on SQLite, so an interrupted run resumes from its last step instead of starting over.
+
+Checkpoints are stored as deltas: the checkpoint row holds no channel values, and a channel's value is written
+(zlib-compressed) only when its version changed, shared by every checkpoint that references that version.
+Only the newest CHECKPOINT_KEEP checkpoints of a thread are kept, with their pending writes and blobs.
+Loading a checkpoint with its values and pending writes is a single hop to a reader thread.
+"""
+import json
+import os
+import sqlite3
+import zlib
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+
+from sqlite_store import SqliteDatabase
+from tracing import traced
+
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "checkpoints.db")
+# checkpoints kept per thread; a run only ever resumes from the newest
+CHECKPOINT_KEEP = int(os.getenv("CHECKPOINT_KEEP", "3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    versions TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS checkpoint_writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    task_path TEXT NOT NULL DEFAULT '',
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver):
+    """
+    Async checkpointer keyed by thread_id; the graph must be run with the async API (ainvoke/astream_events).
+
+    Args:
+        path (str): SQLite database file.
+        keep (int): Checkpoints kept per thread and namespace.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_DB_PATH, keep: int = CHECKPOINT_KEEP, serde=None):
+        super().__init__(serde=serde)
+        self.db = SqliteDatabase(path, _SCHEMA, name="checkpoints")
+        self.keep = keep
+
+    def _dump(self, value: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(value)
+        return type_, zlib.compress(data)
+
+    def _load(self, type_: str, blob: bytes) -> Any:
+        return self.serde.loads_typed((type_, zlib.decompress(blob)))
+
+    # reads
+
+    def _load_tuple(self, conn: sqlite3.Connection, row: tuple) -> CheckpointTuple:
+        thread_id, ns, checkpoint_id, parent_id, type_, blob, metadata_type, metadata = row
+        checkpoint = self._load(type_, blob)
+        versions = checkpoint.get("channel_versions", {})
+        values = {}
+        if versions:
+            placeholders = " OR ".join(["(channel = ? AND version = ?)"] * len(versions))
+            params = [p for channel, version in versions.items() for p in (channel, str(version))]
+            for channel, value_type, value in conn.execute(
+                "SELECT channel, type, blob FROM checkpoint_blobs WHERE thread_id = ? AND checkpoint_ns = ? "
+                f"AND ({placeholders})", (thread_id, ns, *params),
+            ):
+                if value_type != "empty":
+                    values[channel] = self._load(value_type, value)
+        writes = conn.execute(
+            "SELECT task_id, channel, type, blob FROM checkpoint_writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": values},
+            metadata=self._load(metadata_type, metadata),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[(task_id, channel, self._load(t, b)) for task_id, channel, t, b in writes],
+        )
+
+    @traced("store")
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+
+        def _get(conn):
+            columns = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                       "metadata_type, metadata FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?")
+            if checkpoint_id:
+                row = conn.execute(f"{columns} AND checkpoint_id = ?", (thread_id, ns, checkpoint_id)).fetchone()
+            else:
+                row = conn.execute(f"{columns} ORDER BY checkpoint_id DESC LIMIT 1", (thread_id, ns)).fetchone()
+            return self._load_tuple(conn, row) if row else None
+
+        return await self.db.read(_get)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                 "metadata_type, metadata FROM checkpoints WHERE 1 = 1")
+        params = []
+        if config:
+            query += " AND thread_id = ?"
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                query += " AND checkpoint_ns = ?"
+                params.append(config["configurable"]["checkpoint_ns"])
+        if before and get_checkpoint_id(before):
+            query += " AND checkpoint_id < ?"
+            params.append(get_checkpoint_id(before))
+        query += " ORDER BY checkpoint_id DESC"
+
+        def _list(conn):
+            tuples = []
+            for row in conn.execute(query, params).fetchall():
+                item = self._load_tuple(conn, row)
+                if filter and any(item.metadata.get(k) != v for k, v in filter.items()):
+                    continue
+                tuples.append(item)
+                if limit is not None and len(tuples) >= limit:
+                    break
+            return tuples
+
+        for item in await self.db.read(_list):
+            yield item
+
+    # writes
+
+    @traced("store")
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        ns = configurable.get("checkpoint_ns", "")
+        parent_id = configurable.get("checkpoint_id")
+        values = checkpoint.get("channel_values", {})
+        # only the channels updated by this step are stored, unchanged ones point at their existing blob
+        blobs = [
+            (thread_id, ns, channel, str(version), *(self._dump(values[channel]) if channel in values else ("empty", None)))
+            for channel, version in new_versions.items()
+        ]
+        type_, blob = self._dump({**checkpoint, "channel_values": {}})
+        metadata_type, metadata_blob = self._dump(metadata)
+        versions = json.dumps({channel: str(v) for channel, v in checkpoint.get("channel_versions", {}).items()})
+
+        def _put(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO checkpoint_blobs (thread_id, checkpoint_ns, channel, version, type, blob) "
+                "VALUES (?, ?, ?, ?, ?, ?)", blobs,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                "type, checkpoint, metadata_type, metadata, versions) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, ns, checkpoint["id"], parent_id, type_, blob, metadata_type, metadata_blob, versions),
+            )
+            self._prune(conn, thread_id, ns)
+
+        await self.db.write(_put)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    @traced("store")
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+        rows = [
+            (thread_id, ns, checkpoint_id, task_id, task_path, WRITES_IDX_MAP.get(channel, idx), channel,
+             *self._dump(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        # special channels (errors, interrupts) replace the previous write, regular ones are written once
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+
+        def _put_writes(conn):
+            conn.executemany(
+                f"{verb} INTO checkpoint_writes (thread_id, checkpoint_ns, checkpoint_id, task_id, task_path, idx, "
+                "channel, type, blob) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+
+        await self.db.write(_put_writes)
+
+    def _prune(self, conn: sqlite3.Connection, thread_id: str, ns: str):
+        """Drop the checkpoints older than the newest `keep`, their writes, and blobs no kept checkpoint references."""
+        kept = conn.execute(
+            "SELECT checkpoint_id, versions FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT ?", (thread_id, ns, self.keep),
+        ).fetchall()
+        if len(kept) < self.keep:
+            return
+        oldest_kept = kept[-1][0]
+        removed = conn.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+            (thread_id, ns, oldest_kept),
+        ).rowcount
+        if not removed:
+            return
+        conn.execute(
+            "DELETE FROM checkpoint_writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+            (thread_id, ns, oldest_kept),
+        )
+        referenced = {(channel, version) for _, versions in kept for channel, version in json.loads(versions).items()}
+        stale = [
+            (thread_id, ns, channel, version)
+            for channel, version in conn.execute(
+                "SELECT channel, version FROM checkpoint_blobs WHERE thread_id = ? AND checkpoint_ns = ?", (thread_id, ns)
+            )
+            if (channel, version) not in referenced
+        ]
+        conn.executemany(
+            "DELETE FROM checkpoint_blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", stale
+        )
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        def _delete(conn):
+            for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+                conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+        await self.db.write(_delete)
+
+    async def aclose(self):
+        await self.db.close()
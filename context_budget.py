@@ -0,0 +1,180 @@
+"""
+Token-budgeted context for the chat prompt: user facts, conversation summary and unsummarized history each
+get a token budget, and the newest part of each section is kept. Tokens are counted with the Qwen tokenizer
+of dashscope when it is installed, with a character-based estimate otherwise.
+Also records how many prompt tokens the provider served from its prefix cache, where it reports it.
+"""
+import os
+import re
+from typing import Any, Callable, List, Optional, Tuple
+
+from logger import logger
+
+# per-section budgets, in tokens
+CONTEXT_FACTS_TOKENS = int(os.getenv("CONTEXT_FACTS_TOKENS", "400"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "600"))
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", "1200"))
+CONTEXT_TOKENIZER_MODEL = os.getenv("CONTEXT_TOKENIZER_MODEL", "qwen-turbo")
+# context window of the chat model; the summarization trigger is derived from it
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "131072"))
+# unsummarized history is folded into the summary once it reaches this many tokens: by default when it would
+# no longer fit in its prompt budget, and never more than 1/16 of the context window
+SUMMARY_TRIGGER_TOKENS = int(os.getenv(
+    "SUMMARY_TRIGGER_TOKENS", str(min(CONTEXT_HISTORY_TOKENS, MODEL_CONTEXT_TOKENS // 16))))
+
+_CJK = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            from dashscope import get_tokenizer
+            _tokenizer = get_tokenizer(CONTEXT_TOKENIZER_MODEL)
+        except Exception as e:
+            logger.warning("[context_budget] tokenizer unavailable, estimating tokens from characters: %r", e)
+    return _tokenizer
+
+
+def _estimate_tokens(text: str) -> int:
+    # Qwen's tokenizer averages about one token per CJK character and four characters per token otherwise
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    return _estimate_tokens(text)
+
+
+def keep_tail(text: str, max_tokens: int) -> str:
+    """The end of text that fits in max_tokens, whole text if it fits."""
+    if max_tokens <= 0 or not text:
+        return ""
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        ids = tokenizer.encode(text)
+        return text if len(ids) <= max_tokens else tokenizer.decode(ids[-max_tokens:])
+    if _estimate_tokens(text) <= max_tokens:
+        return text
+    # largest suffix within the budget, the estimate grows with the suffix length
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if _estimate_tokens(text[-mid:]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[len(text) - low:]
+
+
+def keep_newest_entries(entries: List[str], max_tokens: int, sep: str = "\n") -> str:
+    """Newest entries (last in the list) that fit in max_tokens, joined oldest first; the newest is cut if alone too big."""
+    kept = []
+    total = 0
+    for entry in reversed(entries):
+        tokens = count_tokens(entry)
+        if total + tokens > max_tokens:
+            if not kept:
+                kept.append(keep_tail(entry, max_tokens))
+            break
+        kept.append(entry)
+        total += tokens
+    return sep.join(reversed(kept))
+
+
+def prompt_usage(message: Any) -> Optional[Tuple[int, int]]:
+    """(input tokens, cached input tokens) reported with a model response, None if the provider did not report them."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage.get("input_tokens"):
+        cached = (usage.get("input_token_details") or {}).get("cache_read")
+        if cached is not None:
+            return usage["input_tokens"], cached
+    # DashScope: response_metadata.token_usage.prompt_tokens_details.cached_tokens
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    input_tokens = token_usage.get("input_tokens") or token_usage.get("prompt_tokens")
+    if not input_tokens:
+        return None
+    details = token_usage.get("prompt_tokens_details") or {}
+    return input_tokens, details.get("cached_tokens", 0)
+
+
+class ContextStats:
+    """Prompt sizes of the requests served by this worker."""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens_sum = 0
+        self.prompt_tokens_max = 0
+        self.truncated = {}  # section -> requests where it was cut
+        # provider-reported usage: responses that carried it, their input tokens and the cached part
+        self.usage_reports = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+
+    def observe(self, prompt_tokens: int, truncated: List[str]):
+        self.requests += 1
+        self.prompt_tokens_sum += prompt_tokens
+        self.prompt_tokens_max = max(self.prompt_tokens_max, prompt_tokens)
+        for section in truncated:
+            self.truncated[section] = self.truncated.get(section, 0) + 1
+
+    def observe_usage(self, message: Any):
+        usage = prompt_usage(message)
+        if usage is None:
+            return
+        self.usage_reports += 1
+        self.input_tokens += usage[0]
+        self.cached_tokens += usage[1]
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens_avg": self.prompt_tokens_sum / self.requests if self.requests else 0.0,
+            "prompt_tokens_max": self.prompt_tokens_max,
+            "truncated": dict(self.truncated),
+            "tokenizer": "dashscope" if _get_tokenizer() is not None else "estimate",
+            "usage_reports": self.usage_reports,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "prefix_cache_hit_rate": self.cached_tokens / self.input_tokens if self.input_tokens else 0.0,
+        }
+
+
+context_stats = ContextStats()
+
+
+def budget_sections(user_facts: str, summary: str, history: str,
+                    facts_tokens: int = CONTEXT_FACTS_TOKENS,
+                    summary_tokens: int = CONTEXT_SUMMARY_TOKENS,
+                    history_tokens: int = CONTEXT_HISTORY_TOKENS,
+                    split_facts: Optional[Callable[[str], List[str]]] = None) -> dict:
+    """
+    Fit each context section in its token budget, keeping the newest content.
+
+    Args:
+        user_facts (str): Rendered user facts, oldest first.
+        summary (str): Rolling conversation summary.
+        history (str): Conversation text not summarized yet, oldest first.
+        split_facts (Callable, optional): Splits user_facts into entries so whole facts are kept.
+
+    Returns:
+        dict: {"user_facts", "summary", "history"} within budget, and "truncated": the sections that were cut.
+    """
+    entries = split_facts(user_facts) if split_facts and user_facts else None
+    sections = {
+        "user_facts": keep_newest_entries(entries, facts_tokens) if entries else keep_tail(user_facts, facts_tokens),
+        "summary": keep_tail(summary, summary_tokens),
+        "history": keep_tail(history, history_tokens),
+    }
+    original = {"user_facts": user_facts, "summary": summary, "history": history}
+    sections["truncated"] = [name for name in original if sections[name] != original[name]]
+    return sections
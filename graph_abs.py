@@ -1,265 +1,155 @@
-import logger
+from logger import logger
 
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.messages import RemoveMessage
 from langgraph.graph import StateGraph, START, END
 
-from utils import init_model
+from utils import get_message_text, init_models
 from langgraph.prebuilt import ToolNode
 from langchain_core.tools import tool
-from typing import TypedDict, Annotated, Optional
+from typing import AsyncIterator, TypedDict, Annotated, NamedTuple, Optional
 from langgraph.graph import add_messages
 from langchain_core.runnables import RunnableConfig
 import asyncio
 
 from dotenv import load_dotenv
-import redis
-import json
-import os, time
-from agent_tools import get_rag_data, search_web_using_bocha
-from langchain_tavily import TavilySearch
-tavily_search = TavilySearch(api_key=os.getenv("TAVILY_API_KEY"))
+import os, re
+from collections import deque
+from agent_tools import search_all
 #from langgraph.graph import dispatch_custom_event
 from langchain_core.callbacks import dispatch_custom_event
 #from video_gen_agent import video_gen_agent    
 
 load_dotenv()
-# Redis connection (optional)
-_redis_client = None
-try:
-    _redis_client = redis.Redis(
-        host=os.getenv("REDIS_HOST", "localhost"),
-        port=int(os.getenv("REDIS_PORT", "6379")),
-        db=int(os.getenv("REDIS_DB", "0")),
-        password=os.getenv("REDIS_PASSWORD") or None,
-        decode_responses=True,
-        socket_timeout=2,
-    )
-    # Ping to verify
-    _redis_client.ping()
-    print("Redis connected for summary storage.")
-except Exception as _e:
-    _redis_client = None
-    print(f"Redis not available, fallback to file: {_e}")
-
-user_global_info = {} # user_id -> session_id -> info
-def set_user_global_fact(user_id: str, fact: str):
-    # Update in-memory store first
-    existing = user_global_info.get(user_id, {})
- 
-    localtime = time.asctime( time.localtime(time.time()) )
-    fact = "record time: " + localtime + "\n" + fact
-    if 'user_fact' not in existing:
-        existing['user_fact'] = fact
-    else:
-        existing['user_fact'] = existing['user_fact'] + '\n' + fact
-    user_global_info[user_id] = existing
-
-    if _redis_client is not None:
-        try:
-            _redis_client.set(f"chat:user_fact:{user_id}", existing['user_fact'])
-        except Exception as e:
-            print(f"[set_user_global_info] Redis set error for {user_id}: {e}")
-    else:
-        try:
-            to_persist = {
-                "user_fact": existing['user_fact'],
-            }
-            with open(f"user_global_info_{user_id}.json", "w", encoding="utf-8") as f:
-                json.dump(to_persist, f, ensure_ascii=False)
-        except Exception as e:
-            print(f"[set_user_global_fact] File persist error for {user_id}: {e}")
-
-def set_user_like_ornot(user_id: str, user_like_ornot_reason: str):
+from session_store import session_store
+from bounded_cache import BoundedCache
+from tool_executor import ToolExecutor
+from session_jobs import SessionJobQueue
+from answer_cache import answer_cache
+from checkpointer import SqliteCheckpointSaver
+from resilience import CircuitOpenError
+from model_router import ModelRouter
+from logger_config import capped
+from tracing import traced
+from context_budget import (CONTEXT_SUMMARY_TOKENS, SUMMARY_TRIGGER_TOKENS, budget_sections, context_stats,
+                            count_tokens, keep_tail)
+
+# Bounded in-process caches in front of session_store; evicted/expired entries are reloaded from the store.
+# The TTL also bounds how stale a worker can be when another worker updated the same user/session.
+user_info_cache = BoundedCache(
+    max_entries=int(os.getenv("USER_INFO_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("USER_INFO_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("USER_INFO_CACHE_TTL", "60")),
+) # user_id -> rendered recent user facts
+session_cache = BoundedCache(
+    max_entries=int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("SESSION_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    ttl=float(os.getenv("SESSION_CACHE_TTL", "60")),
+) # (user_id, session_id) -> {"summary", "history"}
+
+# Budget for the user facts injected into the prompt; the newest entries win
+USER_FACTS_MAX_CHARS = int(os.getenv("USER_FACTS_MAX_CHARS", "2000"))
+# Text of an agent step is held back until the step ends or this many characters arrived without a tool call,
+# so a short preamble the model writes before calling a tool ("let me search...") never reaches the client
+STREAM_HOLDBACK_CHARS = int(os.getenv("STREAM_HOLDBACK_CHARS", "200"))
+
+def render_user_log(entries: list, max_chars: int = USER_FACTS_MAX_CHARS, sep: str = '\n') -> str:
+    """Render the newest log entries that fit in max_chars, oldest first."""
+    rendered = []
+    total = 0
+    for entry in reversed(entries):
+        text = entry.get("text", "")
+        if entry.get("time"):
+            text = f"record time: {entry['time']}\n{text}"
+        if rendered and total + len(text) > max_chars:
+            break
+        rendered.append(text[-max_chars:])
+        total += len(text) + len(sep)
+    return sep.join(reversed(rendered))
+
+def split_user_facts(user_facts: str) -> list:
+    """Entries of a string rendered by render_user_log."""
+    return re.split(r"\n(?=record time: )", user_facts)
+
+async def set_user_global_fact(user_id: str, fact: str):
+    await session_store.append_user_log("user_fact", user_id, fact)
+    # Rendered facts are rebuilt from the log on next read
+    user_info_cache.pop(user_id)
+
+async def set_user_like_ornot(user_id: str, user_like_ornot_reason: str):
     """Save user like or not feedback to Redis and file"""
-    # Update in-memory store first
-    existing = user_global_info.get(user_id, {})
-    
-    localtime = time.asctime(time.localtime(time.time()))
-    feedback = f"record time: {localtime}\n{user_like_ornot_reason}"
-    
-    if 'user_like_ornot' not in existing:
-        existing['user_like_ornot'] = feedback
-    else:
-        existing['user_like_ornot'] = existing['user_like_ornot'] + '\n\n' + feedback
-    user_global_info[user_id] = existing
-    
-    # Persist to Redis when available
-    if _redis_client is not None:
-        try:
-            _redis_client.set(f"chat:user_like_ornot:{user_id}", existing['user_like_ornot'])
-        except Exception as e:
-            print(f"[set_user_like_ornot] Redis set error for {user_id}: {e}")
-    else:
-        # Fallback to file
-        try:
-            # Read existing file and merge
-            to_persist = {}
-            if os.path.exists(f"user_global_info_{user_id}.json"):
-                try:
-                    with open(f"user_global_info_{user_id}.json", "r", encoding="utf-8") as rf:
-                        to_persist = json.load(rf)
-                except:
-                    pass
-            # Update with new like_ornot data
-            to_persist["user_like_ornot"] = existing['user_like_ornot']
-            # Write back
-            with open(f"user_global_info_{user_id}.json", "w", encoding="utf-8") as f:
-                json.dump(to_persist, f, ensure_ascii=False)
-        except Exception as e:
-            print(f"[set_user_like_ornot] File persist error for {user_id}: {e}")
-
-def set_user_session_history(user_id: str, session_id: str, info: dict):
-    # Update in-memory store first
-    #print('set_user_global_info', session_id, info)
-    existing = user_global_info.get(user_id, {}).get(session_id, {})
-    #print(f"set_user_session_history: {info} and {existing}")
-    existing['summary'] = info['summary']
-    # Merge new history with existing history instead of overwriting
-    #existing_history = existing.get('history', '')
-    new_history = info.get('history', '')
-    # Only append if new_history is not empty and not already in existing_history
-    #if new_history and not existing_history.endswith(new_history):
-    #existing['history'] = existing_history + '\n\n' + new_history if existing_history else new_history
-    #else:
-    existing['history'] = new_history
-    user_global_info[user_id][session_id] = existing
-    #print(f"set_user_global_info: {session_id} {list(existing.keys())}")
-
-    # Persist summary to Redis when available
-    summary_value = existing.get("summary", "")
-    history_value = existing.get("history", "")
-    if _redis_client is not None:
-        try:
-            _redis_client.set(f"chat:summary:{user_id}:{session_id}", summary_value)
-            _redis_client.set(f"chat:history:{user_id}:{session_id}", history_value)
-        except Exception as e:
-            print(f"[set_user_global_info] Redis set error for {session_id}: {e}")
-    else:
-        # Keep JSON file as optional fallback/debug snapshot (messages_history only for visibility)
-        try:
-            to_persist = {
-                "summary": summary_value,
-                "history": history_value,
-            }
-            with open(f"user_global_info_{user_id}_{session_id}.json", "w", encoding="utf-8") as f:
-                json.dump(to_persist, f, ensure_ascii=False)
-        except Exception as e:
-            print(f"[set_user_global_info] File persist error for {user_id}:{session_id}: {e}")
-
-def get_user_global_info(user_id: str) -> str:
-    # Ensure in-memory object exists
-    if user_id not in user_global_info:
-        user_global_info[user_id] = {}
-    if 'user_fact' not in user_global_info[user_id]:
-        user_global_info[user_id]['user_fact'] = ""
-    
-    # Load user fact from Redis if available; fallback to file
-    try:
-        user_fact_loaded = None
-        if _redis_client is not None:
-            try:
-                user_fact_key = f"chat:user_fact:{user_id}"
-                user_fact_loaded = _redis_client.get(user_fact_key)
-                print(f"[get_user_global_info] Redis get user_fact: {user_fact_loaded}")
-            except Exception as e:
-                print(f"[get_user_global_info] Redis get error for {user_id}:{user_fact_key}: {e}")
-
-        if user_fact_loaded is not None:
-            user_global_info[user_id]['user_fact'] = user_fact_loaded
-        elif os.path.exists(f"user_global_info_{user_id}.json"):
-            with open(f"user_global_info_{user_id}.json", "r", encoding="utf-8") as f:
-                persisted = json.load(f)
-                if isinstance(persisted, dict):
-                    user_global_info[user_id]['user_fact'] = persisted.get("user_fact", "")
-                    
-    except Exception as e:
-        print(f"[get_user_global_info] Load error for {user_id}: {e}")
-
-    # Do not print potentially large/non-serializable structures
-    #print(f"get_user_global_info: {user_id} {session_id} keys={list(user_global_info[user_id][session_id].keys())}")
-    return user_global_info.get(user_id, {}).get('user_fact', '')
-
-def get_user_session_history(user_id: str, session_id: str) -> dict:
-    # Ensure in-memory object exists
-    if user_id not in user_global_info:
-        user_global_info[user_id] = {}
-   
-    if session_id not in user_global_info[user_id]:
-        user_global_info[user_id][session_id] = {}
-
-    # Load summary from Redis if available; fallback to file
-    try:
-        summary_loaded = None
-        history_loaded = None
-        
-        if _redis_client is not None:
-            try:
-                summary_loaded = _redis_client.get(f"chat:summary:{user_id}:{session_id}")
-                history_loaded = _redis_client.get(f"chat:history:{user_id}:{session_id}")
-            except Exception as e:
-                print(f"[get_user_global_info] Redis get error for {user_id}:{session_id}: {e}")
-
-        if summary_loaded is not None:
-            user_global_info[user_id][session_id]["summary"] = summary_loaded
-            user_global_info[user_id][session_id]["history"] = history_loaded
-        elif os.path.exists(f"user_global_info_{session_id}.json"):
-            with open(f"user_global_info_{user_id}_{session_id}.json", "r", encoding="utf-8") as f:
-                persisted = json.load(f)
-                if isinstance(persisted, dict):
-                    user_global_info[user_id][session_id]["summary"] = persisted.get("summary", "")
-                    user_global_info[user_id][session_id]["history"] = persisted.get("history", "")
-                    
-    except Exception as e:
-        print(f"[get_user_global_info] Load error for {session_id}: {e}")
-
-    # Do not print potentially large/non-serializable structures
-    #print(f"get_user_global_info: {user_id} {session_id} keys={list(user_global_info[user_id][session_id].keys())}")
-    return user_global_info.get(user_id, {}).get(session_id, {})
+    await session_store.append_user_log("user_like_ornot", user_id, user_like_ornot_reason)
+
+async def set_user_session_history(user_id: str, session_id: str, info: dict, cache: bool = True):
+    session = {"summary": info['summary'], "history": info.get('history', ''), "last_turn": info.get('last_turn', '')}
+    if cache:
+        session_cache.set((user_id, session_id), session)
+
+    await session_store.set_session(user_id, session_id, session["summary"], session["history"], session["last_turn"])
+
+async def get_user_global_info(user_id: str) -> str:
+    user_facts = user_info_cache.get(user_id)
+    if user_facts is None:
+        user_facts = render_user_log(await session_store.get_user_log("user_fact", user_id))
+        user_info_cache.set(user_id, user_facts)
+    return user_facts
+
+async def get_user_session_history(user_id: str, session_id: str) -> dict:
+    """Session summary/history; one read from SQLite while Redis is down is marked "degraded" and not cached."""
+    session = session_cache.get((user_id, session_id))
+    if session is None:
+        # Load summary from Redis if available; fallback to file
+        loaded = await session_store.load_session(user_id, session_id)
+        session = loaded["session"] or {"summary": "", "history": "", "last_turn": ""}
+        if loaded["degraded"]:
+            # Redis may hold more than SQLite: cached, this session would be served and written back over it
+            # for SESSION_CACHE_TTL after Redis recovers
+            return {**session, "degraded": True}
+        session_cache.set((user_id, session_id), session)
+    return session
+
+def _with_pending_turns(user_id: str, session_id: str, session: dict) -> dict:
+    """Session as it will be once the queued turns are persisted (without summarizing them)."""
+    queued = pending_turns.get((user_id, session_id))
+    if not queued:
+        return session
+    return {**session, "history": session.get("history", "") + "".join(queued)}
+
+async def get_user_context(user_id: str, session_id: str) -> tuple:
+    """Session summary/history and user facts, from the caches or with a single store round trip; includes queued turns."""
+    session = session_cache.get((user_id, session_id))
+    user_facts = user_info_cache.get(user_id)
+    if session is not None and user_facts is not None:
+        return _with_pending_turns(user_id, session_id, session), user_facts
+
+    loaded = await session_store.load_context(user_id, session_id)
+    # what was read from SQLite while Redis is down is used for this turn only, see get_user_session_history
+    if session is None:
+        session = loaded["session"] or {"summary": "", "history": "", "last_turn": ""}
+        if not loaded["degraded"]:
+            session_cache.set((user_id, session_id), session)
+    if user_facts is None:
+        user_facts = render_user_log(loaded["user_facts"])
+        if not loaded["degraded"]:
+            user_info_cache.set(user_id, user_facts)
+    return _with_pending_turns(user_id, session_id, session), user_facts
 
 async def delete_user_session_history(user_id: str, session_id: str):
     """
-    Delete the history and summary of a particular session_id for a user from redis and file, and in-memory.
+    Delete the history and summary of a particular session_id for a user from redis, sqlite and in-memory.
     """
-    result = {"redis": False, "file": False, "memory": False}
-    # Remove from Redis
-    if '_redis_client' in globals() and _redis_client is not None:
-        try:
-            redis_history_key = f"chat:history:{user_id}:{session_id}"
-            redis_summary_key = f"chat:summary:{user_id}:{session_id}"
-            _redis_client.delete(redis_history_key)
-            _redis_client.delete(redis_summary_key)
-            result["redis"] = True
-        except Exception as e:
-            print(f"[delete_user_session_history] Redis delete error for {user_id}:{session_id}: {e}")
-
-    # Remove from file
-    file_deleted = False
-    file_path = f"user_global_info_{user_id}_{session_id}.json"
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            file_deleted = True
-        except Exception as e:
-            print(f"[delete_user_session_history] File delete error for {file_path}: {e}")
-    result["file"] = file_deleted
-
-    # Remove from memory
-    mem_deleted = False
-    try:
-        if user_id in user_global_info:
-            if session_id in user_global_info[user_id]:
-                del user_global_info[user_id][session_id]
-                mem_deleted = True
-    except Exception as e:
-        print(f"[delete_user_session_history] Memory delete error for {user_id}:{session_id}: {e}")
-    result["memory"] = mem_deleted
-
+    result = await session_store.delete_session(user_id, session_id)
+    result["memory"] = session_cache.pop((user_id, session_id)) is not None
+    if checkpointer is not None:
+        await checkpointer.adelete_thread(session_thread_id(user_id, session_id))
     return result
 
-chat_tools = [get_rag_data, search_web_using_bocha, tavily_search] 
+# One aggregated tool over the knowledge base, Bocha/Serper and Tavily:
+# the model makes one call and gets a single deduplicated, size-bounded block
+chat_tools = [search_all]
 
 chat_tool_node = ToolNode(chat_tools)
+chat_tool_executor = ToolExecutor(chat_tool_node)
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
@@ -269,54 +159,44 @@ class State(TypedDict):
     intention: str #  the intention of the user
     summary: str #  the summary of the conversation
     history: str #  the history of the conversation that is not summarized yet
+    turn_id: str #  id of the turn, kept when the turn is resumed from its checkpoint
     #N: int = 10 #  the number of messages to keep 
-    threshold: int = 2000 #  the threshold of messages, if len > threshold, then summarize the messages
 
-# Initialize model
-model_raw, model_turbo = init_model()
-model = model_raw.bind_tools(chat_tools)
+# Initialize models: each call is routed to a model by task, see model_router
+model_router = ModelRouter(init_models())
 # Create graph
 builder = StateGraph(state_schema=State)   
 
+def conversation_to_text(messages: list) -> str:
+    """User and assistant turns as "Role: text" blocks; tool messages and empty messages are skipped."""
+    roles = {"human": "User", "ai": "Assistant", "assistant": "Assistant"}
+    blocks = []
+    for msg in messages:
+        if msg.type == "tool" or not isinstance(msg.content, str) or not msg.content.strip():
+            continue
+        blocks.append(f"{roles.get(msg.type, 'Unknown')}: {msg.content}\n\n")
+    return "".join(blocks)
+
 # 定义摘要逻辑
-async def summarize_conversation(state: State):
-    summary = state.get("summary", "")
-    history = state.get("history", "")
-    # Filter messages to avoid tool call issues - only include text content
-    messages_to_summarize = state["messages"]
-    print(f"all state messages count: {len(messages_to_summarize)}")
-    
-    # Build a text representation of the conversation from ALL messages
-    # Note: state["messages"] contains ALL messages due to LangGraph checkpoint restoration
-    conversation_text = ""
-    for msg in messages_to_summarize:
-        if hasattr(msg, 'content') and isinstance(msg.content, str) and msg.content.strip():
-            if hasattr(msg, 'type'):
-                if msg.type == "tool":
-                    role = "Tool"
-                    continue
-                elif msg.type == "human":
-                    role = "User"
-                elif msg.type in ["assistant", "ai"]:
-                    role = "Assistant"
-                else:
-                    role = "Unknown"
-                #role = "User" if msg.type == "human" else "Assistant"
-                conversation_text += f"{role}: {msg.content}\n\n"
-
-    print(f"conversation_text length: {len(conversation_text)}, history length: {len(history)}")
-    print(f"conversation_text preview: {conversation_text[:200]}...")
-
-    # Since conversation_text contains ALL messages (due to checkpoint restoration),
-    # we should REPLACE history with conversation_text, not append, to avoid duplicates
-    if len(history) + len(conversation_text) < state['threshold']: # if the conversation text is not too long, then return the summary and history
-        # Clear all messages after summarizing (using RemoveMessage for all messages)
-        delete_messages = [RemoveMessage(id=msg.id) for msg in messages_to_summarize if hasattr(msg, 'id')]
-        return {"summary": summary, "history": history + conversation_text, "messages": delete_messages}
+@traced("job", "summarize")
+async def fold_history(summary: str, history: str, threshold: int = SUMMARY_TRIGGER_TOKENS) -> tuple:
+    """
+    Fold the unsummarized history into the rolling summary once it reaches threshold tokens.
+
+    The summarization prompt is the bounded old summary plus the history added since the last summary,
+    so its cost does not grow with the session.
+
+    Returns:
+        tuple: (summary, history) to persist.
+    """
+    history_tokens = count_tokens(history)
+    logger.debug("[fold_history] unsummarized history tokens: %d, threshold: %d", history_tokens, threshold)
+    if history_tokens < threshold:
+        return summary, history
 
     if summary:
         uptodate_message= (
-            f"This is summary of the conversation to date: {summary}\n\n"
+            f"This is summary of the conversation to date: {keep_tail(summary, CONTEXT_SUMMARY_TOKENS)}\n\n"
         )
 
         summary_message = (
@@ -326,68 +206,141 @@ async def summarize_conversation(state: State):
             "Include as many specific details as you can."
             "Keep summary short and concise. you MUST summarize in Chinese."
         )
-        #print(f"summary_message: {summary_message}")
     else:
         uptodate_message= ''
         summary_message = "Create a summary of the conversation above:"
-       
-   # if the conversation text is longer than threshold, then summarize it
-    # conversation_text already contains ALL messages, so don't concatenate with history to avoid duplicates
+    # a single very long turn is cut to its newest part so the prompt stays bounded
+    new_text = keep_tail(history, 2 * threshold)
     messages = [
-        HumanMessage(content=f"{uptodate_message}\n\n{history} {conversation_text}\n\n{summary_message}")
+        HumanMessage(content=f"{uptodate_message}\n\n{new_text}\n\n{summary_message}")
     ]
-    print(f"summary messages: {messages}")
-    response = await model_raw.ainvoke(messages)
-    print(f"summary response: {response.content}")
-   
-    # Clear all messages after summarizing (using RemoveMessage for all messages)
-    delete_messages = [RemoveMessage(id=msg.id) for msg in messages_to_summarize if hasattr(msg, 'id')]
-    return {"summary": response.content, "history": '', "messages": delete_messages}
+    logger.debug("[fold_history] summary prompt: %s", capped(messages), extra={"sample": "summary_prompt"})
+    try:
+        response = await model_router.ainvoke("summary", messages)
+    except Exception as e:
+        # model unavailable or failing (breaker open, timeout, provider 5xx or rate limit): keep the text
+        # unsummarized so the turn is still persisted, the next turn summarizes it
+        logger.warning("[fold_history] summary deferred: %r", e)
+        return summary, history
+    logger.debug("[fold_history] summary: %s", capped(response.content))
+    return response.content, ''
+
+# Summaries are folded and persisted after the answer was streamed, one turn at a time per session
+summary_jobs = SessionJobQueue("summary")
+pending_turns = {}  # (user_id, session_id) -> texts of turns queued but not persisted yet, oldest first
+turn_numbers = BoundedCache(max_entries=100000, ttl=3600)  # (user_id, session_id) -> newest turn number handed out
+
+def _turn_number(turn_id: str) -> int:
+    number = turn_id.rsplit(":", 1)[-1]
+    return int(number) if number.isdigit() else 0
+
+def next_turn_id(user_id: str, session_id: str, session: dict) -> str:
+    """
+    "{thread_id}:{n}" for a new turn of the session, n following the session's last persisted turn, its queued
+    turns and the turns started in this process.
+    """
+    key = (user_id, session_id)
+    number = max(_turn_number(session.get("last_turn", "")) + len(pending_turns.get(key, ())),
+                 turn_numbers.get(key, 0, count=False)) + 1
+    turn_numbers.set(key, number)
+    return f"{session_thread_id(user_id, session_id)}:{number}"
 
+def submit_turn(user_id: str, session_id: str, turn_id: str, messages: list) -> bool:
+    """
+    Queue the finished turn for summarization and persistence. A turn_id already submitted is ignored, and a turn
+    already recorded as the session's last_turn is not written again.
+    """
+    text = conversation_to_text(messages)
+    if not text:
+        return False
+    key = (user_id, session_id)
+
+    def dequeue():
+        queued = pending_turns[key]
+        queued.popleft()
+        if not queued:
+            del pending_turns[key]
+
+    async def persist_turn():
+        try:
+            session = await get_user_session_history(user_id, session_id)
+            if session.get("last_turn") == turn_id:
+                # e.g. submitted again by another worker, or after a restart
+                dequeue()
+                logger.info("[persist_turn] turn %s is already persisted", turn_id)
+                return
+            summary, history = await fold_history(session.get("summary", ""), session.get("history", "") + text)
+            if session.get("degraded"):
+                # re-read before writing: if Redis came back meanwhile, fold onto what it holds instead of
+                # overwriting it with a session built from SQLite
+                session = await get_user_session_history(user_id, session_id)
+                if session.get("last_turn") == turn_id:
+                    dequeue()
+                    return
+                if not session.get("degraded"):
+                    summary, history = await fold_history(session.get("summary", ""),
+                                                          session.get("history", "") + text)
+        except Exception:
+            dequeue()
+            raise
+        # dequeued right before the cache update, so readers never see the turn in both or in neither
+        dequeue()
+        await set_user_session_history(user_id, session_id,
+                                       {"summary": summary, "history": history, "last_turn": turn_id},
+                                       cache=not session.get("degraded"))
+
+    if not summary_jobs.submit(key, turn_id, persist_turn):
+        return False
+    pending_turns.setdefault(key, deque()).append(text)
+    return True
+
+
+MODEL_UNAVAILABLE_REPLY = "抱歉，模型服务暂时不可用，请稍后再试。"
+
+# Static instructions, the cacheable prefix of every chat prompt: keep anything per-user or per-request out of it
+CHAT_SYSTEM_PROMPT = """You are the best product recommendation agent in the world. 
+        Review information about the user and their prior conversation summary below and respond accordingly.
+        You have knowledge about any product the customers asks you a recommendation for.
+        Your recommendations are logical and can convince the people who are looking for the 
+        product. Don't ask user what brand they want to buy. Suggest everything you know using the tools you have
+        if user ask you a question, you should call the search_all tool once to search the knowledge base and the web for information about the user's question
+        if you reply user without calling the search_all tool, you MUST tell user that you are pretty sure what user said is not related to the web, then you answer with your own knowledge.
+        your response should be in Chinese. Keep responses short and concise.
+        """
 
 
+@traced("node", "agent")
 async def chatbot(state: State):
     summary = state['summary'] 
     user_facts = state['user_facts']
     history = state['history']
 
-    if True:
-        system_message = SystemMessage(
-        content=f"""You are the best product recommendation agent in the world. 
-        Review information about the user and their prior conversation summary below and respond accordingly.
-        You have knowledge about any product the customers asks you a recommendation for.
-        Your recommendations are logical and can convince the people who are looking for the 
-        product. Don't ask user what brand they want to buy. Suggest everything you know using the tools you have
-        if user ask you a question, you should call tavily search tool to search the web for information about the user's question
-        if you reply user without calling tavily search tool, you MUST tell user that you are pretty sure what user said is not related to the web, then you answer with your own knowledge.
-        your response should be in Chinese. Keep responses short and concise.
-        """
-    )
+    # stable prefix first: tool schemas (bound once at import) and CHAT_SYSTEM_PROMPT are byte-identical for
+    # every request, the per-user context goes after them so the provider can reuse the cached prefix
+    # each section is cut to its token budget so long-lived users get prompts as small as new users
+    sections = budget_sections(user_facts, summary, history, split_facts=split_user_facts)
+    context = ""
+    if sections["user_facts"] != "":
+        context += f"here is the facts about the user: {sections['user_facts']}\n\n"
+    if sections["summary"] != "":
+        context += f"here is the historical conversation summary: {sections['summary']}\n\n"
+    if sections["history"] != "":
+        context += f"here is the historical conversation history that is not summarized yet: {sections['history']}\n\n"
+    system_message = SystemMessage(content=CHAT_SYSTEM_PROMPT + context)
+
+    prompt_tokens = count_tokens(system_message.content) + sum(
+        count_tokens(get_message_text(m)) for m in state['messages'])
+    context_stats.observe(prompt_tokens, sections["truncated"])
+    logger.info("[chatbot] prompt tokens: %d, truncated sections: %s", prompt_tokens, sections["truncated"])
+    logger.debug("[chatbot] system prompt: %s", capped(system_message.content), extra={"sample": "system_prompt"})
+    try:
+        message_updates = await model_router.ainvoke(
+            "answer", [system_message] + state['messages'], tools=chat_tools, input_tokens=prompt_tokens, stream=True)
+    except (CircuitOpenError, asyncio.TimeoutError) as e:
+        logger.warning("[chatbot] model unavailable: %r", e)
+        message_updates = AIMessage(content=MODEL_UNAVAILABLE_REPLY)
     else:
-        system_message = SystemMessage(
-            content=f"""You are a helpful assistant. 
-            Review information about the user and their prior conversation summary below and respond accordingly.
-            if user ask you a question, you should call rag tool to search in the rag database even user's question is very easy.
-            the dataset_id to search the RAG database is {state['dataset_id']}
-            if you reply user without calling rag tool, you MUST tell user that you are pretty sure what user said is not related to the rag database, then you answer with your own knowledge.
-            your response should be in Chinese.
-            then you should call web search tool to search the web for information about the user's question, the topk of the web search is 5.
-            generally, your response should contain two parts:
-            part 1: based on the information you got from the rag tool, if the information is relevant to the user's question, you should answer the user's question based on the information you got from the rag tool start with "根据知识库返回的信息，," otherwise tell user you can not find related information in the database.
-            part 2. based on your own knowledge, if you know something related to the user's question, you should answer the user's question start with "以下内容和知识库返回的信息无关，仅供参考，据我所知,"
-            Keep responses short and concise.
-            """
-        )
-
-    if user_facts != "":
-        system_message.content += f"here is the facts about the user: {user_facts}\n\n"
-    if summary != "":
-        system_message.content += f"here is the historical conversation summary: {summary}\n\n"
-    if history != "":
-        system_message.content += f"here is the historical conversation history that is not summarized yet: {history}\n\n"
-        
-    print(f"system_message: {system_message.content}")
-    message_updates = await model.ainvoke([system_message] + state['messages'])
+        context_stats.observe_usage(message_updates)
     return {'messages': message_updates}
 
 
@@ -401,51 +354,150 @@ async def should_continue(state: State):
     if last_msg and hasattr(last_msg, 'tool_calls') and last_msg.tool_calls:
         return 'tools'
 
-    return 'summarize'
+    return END
 
 
 graph_builder.add_node('agent', chatbot)
-graph_builder.add_node('tools', chat_tool_node)
-graph_builder.add_node('summarize', summarize_conversation)
+@traced("node", "tools")
+async def run_tools(state: State, config: RunnableConfig):
+    # parallel tool calls with per-tool timeouts/concurrency limits, see tool_executor
+    return await chat_tool_executor.ainvoke(state, config)
+
+graph_builder.add_node('tools', run_tools)
 
 graph_builder.add_edge(START, 'agent')
-graph_builder.add_conditional_edges('agent', should_continue, {'tools': 'tools', 'summarize': 'summarize'})
+graph_builder.add_conditional_edges('agent', should_continue, {'tools': 'tools', END: END})
 graph_builder.add_edge('tools', 'agent')
-graph_builder.add_edge('summarize', END)
 
-chat_app = graph_builder.compile()
+# Per-session checkpoints (thread_id "{user_id}:{session_id}") let a run interrupted by a restart resume from its
+# last completed step; CHECKPOINTER=none runs without them
+checkpointer = SqliteCheckpointSaver() if os.getenv("CHECKPOINTER", "sqlite") == "sqlite" else None
+chat_app = graph_builder.compile(checkpointer=checkpointer)
 
-async def run_with_monitoring_events(query: str, dataset_id: str, user_id: str, session_id: str, do_web_search: bool) -> State:
-    """使用事件流监控运行Agent，返回事件流"""
-    all_history = get_user_session_history(user_id, session_id)
-    summary = all_history.get("summary", "")
-    history = all_history.get("history", "")
+def session_thread_id(user_id: str, session_id: str) -> str:
+    return f"{user_id}:{session_id}"
+
+class ChatEvent(NamedTuple):
+    """Event of run_chat_stream: "token" (a streamed delta of the answer) or "message" (a whole answer text)."""
+    kind: str
+    text: str
+
+
+async def _start_turn(query: str, dataset_id: str, user_id: str, session_id: str, do_web_search: bool,
+                      use_cache: bool) -> dict:
+    """
+    Load the context of a turn and decide how it runs.
+
+    Returns:
+        dict: "turn_id", "bypass" (why the answer cache is not used, or None), "cached" (a cached answer or None),
+            "input" (graph input, None to resume an interrupted run), "config" and "messages" (the turn's messages
+            the graph will not report again: the question, or the interrupted run's messages when resuming).
+    """
+    all_history, user_facts = await get_user_context(user_id, session_id)
+    turn = {"turn_id": next_turn_id(user_id, session_id, all_history), "cached": None}
+    if use_cache:
+        turn["bypass"] = answer_cache.bypass(user_id, all_history, user_facts)
+    else:
+        turn["bypass"] = "request"
+        answer_cache.record_bypass("request")
+    if not turn["bypass"]:
+        turn["cached"] = await answer_cache.lookup(query, dataset_id, do_web_search)
+        if turn["cached"] is not None:
+            logger.info("[answer_cache] %s hit (similarity %.3f) for: %s",
+                        turn["cached"]["match"], turn["cached"]["similarity"], capped(query, 200))
+            return turn
+
+    question = HumanMessage(content=query)
+    initial_state = State(messages=[question], dataset_id=dataset_id, user_facts=user_facts,
+                          summary=all_history.get("summary", ""), history=all_history.get("history", ""),
+                          do_web_search=do_web_search, turn_id=turn["turn_id"])
+    config = RunnableConfig(recursion_limit=50)
+    turn_messages = [question]
+    if checkpointer is not None:
+        config["configurable"] = {"thread_id": session_thread_id(user_id, session_id)}
+        snapshot = await chat_app.aget_state(config)
+        previous = snapshot.values.get("messages", [])
+        if snapshot.next and previous and previous[0].type == "human" and previous[0].content == query:
+            # the same question was interrupted mid-run: continue from its last checkpoint, finished tool calls are kept
+            logger.info("[chatbot] resuming at %s", snapshot.next)
+            initial_state = None
+            turn_messages = list(previous)
+            # the interrupted run's id, so a turn that was submitted before the interruption is not persisted twice
+            turn["turn_id"] = snapshot.values.get("turn_id") or turn["turn_id"]
+        else:
+            # the checkpoint still holds the previous turn, which is already in summary/history
+            initial_state["messages"] = [RemoveMessage(id=m.id) for m in previous if m.id] + initial_state["messages"]
+    turn.update({"input": initial_state, "config": config, "messages": turn_messages})
+    return turn
+
+
+async def _finish_turn(turn: dict, query: str, dataset_id: str, user_id: str, session_id: str, do_web_search: bool,
+                       messages: list):
+    # summarizing and persisting the turn happen in the background
+    submit_turn(user_id, session_id, turn["turn_id"], messages)
+    final = messages[-1] if messages else None
+    # partial answers (the model failed mid-stream) are shown but not cached
+    if not turn["bypass"] and final is not None and final.type == "ai" and not getattr(final, "tool_calls", None) \
+            and final.content and final.content != MODEL_UNAVAILABLE_REPLY \
+            and not final.response_metadata.get("partial"):
+        await answer_cache.store(query, dataset_id, do_web_search, get_message_text(final))
+
+
+async def run_chat_stream(query: str, dataset_id: str, user_id: str, session_id: str, do_web_search: bool,
+                          use_cache: bool = True) -> AsyncIterator[ChatEvent]:
+    """
+    Run a turn and yield only the answer text, as ChatEvents; the /query/ hot path.
+
+    Uses the graph's "messages" (model deltas) and "updates" (node outputs) stream modes instead of
+    astream_events, which reports every runnable, tool and model call of the graph.
+    """
+    turn = await _start_turn(query, dataset_id, user_id, session_id, do_web_search, use_cache)
+    if turn["cached"] is not None:
+        answer = AIMessage(content=turn["cached"]["answer"])
+        submit_turn(user_id, session_id, turn["turn_id"], [HumanMessage(content=query), answer])
+        yield ChatEvent("message", answer.content)
+        return
+
+    messages = turn["messages"]
+    # state of the agent's current step: text held back, whether it is streaming, whether it calls tools
+    held, streamed, calls_tools = "", False, False
+    async for mode, payload in chat_app.astream(turn["input"], turn["config"], stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") != "agent":
+                continue
+            if getattr(chunk, "tool_call_chunks", None):
+                # tool call arguments are assembled by the model into the final message, never shown, and the
+                # text before them was not the answer
+                held, calls_tools = "", True
+                continue
+            text = get_message_text(chunk) if chunk.type in ("ai", "AIMessageChunk") else ""
+            if not text or calls_tools:
+                continue
+            if streamed:
+                yield ChatEvent("token", text)
+                continue
+            held += text
+            if len(held) >= STREAM_HOLDBACK_CHARS:
+                streamed = True
+                yield ChatEvent("token", held)
+                held = ""
+            continue
+        for node, update in (payload or {}).items():
+            node_messages = (update or {}).get("messages", [])
+            node_messages = node_messages if isinstance(node_messages, list) else [node_messages]
+            messages.extend(node_messages)
+            if node == "agent":
+                final = node_messages[-1] if node_messages else None
+                if final is not None and not getattr(final, "tool_calls", None):
+                    if held:
+                        yield ChatEvent("token", held)
+                    elif not streamed and final.content:
+                        # answers that were not generated by the model (fallback replies) arrive only as node output
+                        yield ChatEvent("message", get_message_text(final))
+                held, streamed, calls_tools = "", False, False
+    await _finish_turn(turn, query, dataset_id, user_id, session_id, do_web_search, messages)
 
-    user_facts = get_user_global_info(user_id)
-        
-    initial_state = State(messages=[HumanMessage(content=query)], dataset_id=dataset_id, user_facts=user_facts, 
-    summary=summary, history=history, threshold=1000, do_web_search=do_web_search)
-    
-    print(f"Chatbot Starting")
-    # 返回事件流
-    # No thread_id needed since we're not using checkpointer
-    async for event in chat_app.astream_events(
-        initial_state,
-        RunnableConfig(recursion_limit=50),
-        version="v2",
-    ):
-        if event["event"] == "on_chain_end":
-            #if event.get("name") == "summarize":
-            name = event.get("name")
-            #print(f"name: {name}")
-            agent_output = event.get("data", {}).get("output", {})
-            #print(f"Agent output: {agent_output}")
-            if name == "summarize":
-                summary = event.get("data", {}).get("output", {}).get("summary", "")
-                history = event.get("data", {}).get("output", {}).get("history", "")
-                set_user_session_history(user_id, session_id, {"summary": summary, "history": history})
-        yield event
-        
 
 if __name__ == "__main__":
     async def test_comfyui():
@@ -1,16 +1,130 @@
+"""
+Logging set up for the request path: callers only enqueue records, a background listener thread formats them
+and writes the console and the rotating file.
+
+- The logger level (LOG_LEVEL) is checked before anything is built, and QueueHandler does not format on the
+  caller's thread, so a debug call costs next to nothing when debug is off. Log with %-style arguments.
+- Verbose events (system prompts, RAG results, model payloads) are logged with extra={"sample": "<event>"} and
+  only a LOG_SAMPLE_RATE share of them is kept (per event: LOG_SAMPLE_RATES="rag_results=0.01,system_prompt=0").
+- Large payloads are wrapped in capped(), which truncates them to LOG_MAX_FIELD_CHARS when the writer formats them.
+- LOG_FORMAT=json writes one JSON object per line with the extra fields of the record.
+"""
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Define the log directory
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_CONSOLE_LEVEL = os.getenv("LOG_CONSOLE_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# share of the sampled verbose events that are written
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (item.split("=", 1) for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if "=" in item)
+}
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+# records waiting for the writer thread; when full, new records are dropped rather than blocking the event loop
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listeners = {}
+
+
+class capped:
+    """Log argument truncated to max_chars when the record is formatted, on the writer thread."""
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value, max_chars: int = LOG_MAX_FIELD_CHARS):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) <= self.max_chars:
+            return text
+        return f"{text[:self.max_chars]}... (+{len(text) - self.max_chars} chars)"
+
+    __repr__ = __str__
+
+
+class SampleFilter(logging.Filter):
+    """Keeps records tagged with extra={"sample": event} at the event's sampling rate, all other records."""
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE, rates: dict = None):
+        super().__init__()
+        self.rate = rate
+        self.rates = LOG_SAMPLE_RATES if rates is None else rates
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "sample", None)
+        if event is None:
+            return True
+        if random.random() < self.rates.get(event, self.rate):
+            return True
+        self.dropped += 1
+        return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener and never blocks on a full queue."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the stock prepare() formats the message here, on the caller's thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the record's extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sample":
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _formatter() -> logging.Formatter:
+    return JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(_TEXT_FORMAT)
+
+
 # Configure the logger
 def setup_logger(name):
     """
     Set up a logger with a specific name.
 
+    Records go through a queue to a listener thread that owns the console and rotating file handlers.
+
     Args:
         name (str): Name of the logger (usually __name__ of the module).
 
@@ -18,29 +132,36 @@ def setup_logger(name):
         logging.Logger: Configured logger instance.
     """
     logger = logging.getLogger(name)
-
-    logger.setLevel(logging.DEBUG)  # Log everything, including debug-level messages
+    logger.setLevel(LOG_LEVEL)
+    if name in _listeners or logger.hasHandlers():  # Avoid duplicate handlers
+        return logger
 
     # Console Handler
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)  # Console logs only for info and above
-    console_format = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    console_handler.setFormatter(console_format)
+    console_handler.setLevel(LOG_CONSOLE_LEVEL)
+    console_handler.setFormatter(_formatter())
 
     # File Handler (Rotating)
     log_file = os.path.join(LOG_DIR, f"{name}.log")
-    file_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=3)
-    file_handler.setLevel(logging.DEBUG)
-    file_format = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    file_handler.setFormatter(file_format)
-
-    # Add Handlers
-    if not logger.hasHandlers():  # Avoid duplicate handlers
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+    file_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8")
+    file_handler.setFormatter(_formatter())
+
+    queue_handler = DeferredQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SampleFilter())
+    logger.addHandler(queue_handler)
+    logger.propagate = False
 
+    listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    _listeners[name] = listener
     return logger
+
+
+def stop_logging():
+    """Write the queued records and stop the listener threads."""
+    while _listeners:
+        _, listener = _listeners.popitem()
+        listener.stop()
+
+
+atexit.register(stop_logging)
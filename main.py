@@ -1,19 +1,42 @@
 import argparse
 from typing import Dict, Any
-import json
-import re
+import time
 
 import uvicorn
 from fastapi import FastAPI, HTTPException, Query, Form
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
-from graph_abs import run_with_monitoring_events, set_user_global_fact, set_user_like_ornot
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from graph_abs import run_chat_stream, set_user_global_fact, set_user_like_ornot
 
 app = FastAPI()
 
 from fastapi import Body
-from graph_abs import delete_user_session_history
+from graph_abs import delete_user_session_history, chat_tool_executor, summary_jobs, model_router, checkpointer
+from graph_abs import session_cache, user_info_cache
+from session_store import session_store
+from agent_tools import ragflow
+from retrieval_cache import retrieval_cache
+from search_web import close_http_client, search_stats
+from search_cache import search_cache
+from resilience import breaker_stats
+from answer_cache import answer_cache
+from context_budget import context_stats
+from tracing import LatencyHistogram, metrics, request_trace, shutdown_tracing
+from logger import logger
+from logger_config import capped, stop_logging
+
+@app.on_event("shutdown")
+async def close_session_store():
+    # queued summaries still need the store
+    await summary_jobs.drain()
+    await session_store.close()
+    if checkpointer is not None:
+        await checkpointer.aclose()
+    await ragflow.aclose()
+    await close_http_client()
+    shutdown_tracing()
+    stop_logging()
 
 @app.post("/delete_session_history")
 async def delete_session_history(
@@ -51,7 +74,7 @@ async def upload_user_fact(
     """
     Upload user fact to the global info.
     """
-    set_user_global_fact(user_id, user_fact)
+    await set_user_global_fact(user_id, user_fact)
     return {"message": "User fact uploaded to global info successfully"}
 
 @app.post("/upload_user_like_ornot")
@@ -66,9 +89,133 @@ async def upload_user_like_ornot(
     """
     Upload user like or not feedback to Redis.
     """
-    set_user_like_ornot(user_id, user_like_ornot_reason)
+    await set_user_like_ornot(user_id, user_like_ornot_reason)
     return {"message": "User like or not feedback uploaded successfully"}
 
+@app.post("/rag_cache/invalidate")
+async def invalidate_rag_cache(
+    dataset_id: str = Query(
+        ...,
+        description="The dataset id whose documents changed.",
+        examples=["1"],
+    ),
+):
+    """
+    Drop cached retrieval results of a dataset, call after uploading/deleting/parsing its documents.
+    """
+    removed = await retrieval_cache.invalidate_dataset(dataset_id)
+    # answers built on the old documents go too
+    answers_removed = answer_cache.invalidate_dataset(dataset_id)
+    return {"message": f"Retrieval cache for dataset_id={dataset_id} invalidated.", "removed": removed,
+            "answers_removed": answers_removed}
+
+@app.get("/rag_cache/stats")
+async def rag_cache_stats():
+    """
+    Retrieval cache size and hit ratios.
+    """
+    return retrieval_cache.stats()
+
+@app.get("/answer_cache/stats")
+async def answer_cache_stats():
+    """
+    Answer cache size, exact and semantic hits, misses and bypassed requests, in total and per reason.
+    """
+    return answer_cache.stats()
+
+@app.get("/session_cache/stats")
+async def session_cache_stats():
+    """
+    Entries, memory, hits, misses, evictions and expirations of the in-process user facts and session caches.
+    """
+    return {"user_info": user_info_cache.stats(), "session": session_cache.stats()}
+
+@app.get("/search/stats")
+async def web_search_stats():
+    """
+    Per-provider web search win rates and latencies, and search cache hit counts.
+    """
+    return {"providers": search_stats(), "cache": search_cache.stats()}
+
+@app.get("/tools/stats")
+async def tool_stats():
+    """
+    Per-tool outcomes and latency histograms.
+    """
+    return chat_tool_executor.stats()
+
+@app.get("/resilience/stats")
+async def resilience_stats():
+    """
+    Circuit breaker state, p99 latency and current timeout per external dependency.
+    """
+    return breaker_stats()
+
+@app.get("/router/stats")
+async def router_stats():
+    """
+    Calls, failures, tokens, estimated cost and latency per task and model role.
+    """
+    return model_router.snapshot()
+
+@app.get("/summary/stats")
+async def summary_job_stats():
+    """
+    Background summarization jobs: submitted, completed, failed, duplicate and still queued turns.
+    """
+    return summary_jobs.stats()
+
+@app.get("/context/stats")
+async def prompt_context_stats():
+    """
+    Prompt sizes in tokens, how often each context section was cut to its budget and the provider prefix cache hit rate.
+    """
+    return context_stats.snapshot()
+
+# time from request to the first streamed text
+ttft_histogram = LatencyHistogram()
+metrics.register("chat_time_to_first_token_seconds", "histogram", "Time from /query/ to the first streamed text",
+                 lambda: {(): ttft_histogram})
+metrics.register("chat_circuit_breaker_open", "gauge", "1 while the dependency's circuit breaker is not closed",
+                 lambda: {(("name", name),): int(s["state"] != "closed") for name, s in breaker_stats().items()})
+_context_caches = {"user_info": user_info_cache, "session": session_cache}
+for _metric, _type, _help, _field in (
+    ("chat_context_cache_hits_total", "counter", "Hits of the in-process user facts and session caches", "hits"),
+    ("chat_context_cache_misses_total", "counter", "Misses of the in-process user facts and session caches", "misses"),
+    ("chat_context_cache_entries", "gauge", "Entries in the in-process user facts and session caches", "entries"),
+    ("chat_context_cache_bytes", "gauge", "Approximate memory of the in-process user facts and session caches",
+     "bytes"),
+):
+    metrics.register(_metric, _type, _help, lambda field=_field: {
+        (("cache", name),): cache.stats()[field] for name, cache in _context_caches.items()})
+
+async def timed_stream(stream, thread_id: str):
+    start = time.perf_counter()
+    first = True
+    async for text in stream:
+        if first and text:
+            first = False
+            ttft = time.perf_counter() - start
+            ttft_histogram.observe(ttft)
+            logger.info("[perform_query] thread_id=%s time to first token: %.0f ms", thread_id, ttft * 1000)
+        yield text
+
+@app.get("/query/stats")
+async def query_stats():
+    """
+    Time to first token histogram of /query/.
+    """
+    return {"ttft": ttft_histogram.snapshot()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Span durations by kind (request, node, llm, tool, dependency, store, job), model tokens and cost,
+    time to first token, circuit breaker states and user facts / session cache counters, in the Prometheus
+    text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/query/")
 async def perform_query(
     original_query: str = Query(
@@ -96,125 +243,33 @@ async def perform_query(
         description="Whether to do web search.",
         examples=[True],
     ),
+    use_cache: bool = Query(
+        True,
+        description="Whether a cached answer to the same or a very similar question may be served.",
+        examples=[True],
+    ),
 ):
     """
     Stream responses from the chatbot for the provided query.
     """
     async def event_stream():
-        last_video_url_local = None
-        last_image_url_local = None
-        def _iter_messages(msgs):
-            if isinstance(msgs, list):
-                for m in msgs:
-                    yield m
-            elif msgs is not None:
-                yield msgs
-
-        def _extract_first_url_from_text(text: str):
-            matches = re.findall(r"https?://[\w\-./?=&%#]+", text)
-            return matches[0] if matches else None
-
-        def _extract_url_from_chunk(chunk: Dict[str, Any], list_key: str):
-            if not isinstance(chunk, dict):
-                return None
-            urls = chunk.get(list_key)
-            if isinstance(urls, list):
-                for candidate in reversed(urls):
-                    if isinstance(candidate, str) and candidate:
-                        return candidate
-            for msg in _iter_messages(chunk.get("messages")):
-                content = getattr(msg, "content", None)
-                if isinstance(content, str):
-                    url = _extract_first_url_from_text(content)
-                    if url:
-                        return url
-            return None
-        print(f"[event_stream] 开始 original_query={original_query} dataset_id={dataset_id} user_id={user_id} thread_id={thread_id}")
-        try:
-            async for event in run_with_monitoring_events(original_query, dataset_id, user_id, thread_id, do_web_search):
-                ev_type = event.get("event")
-                print(f"[event_stream] 收到 事件: {event}")
-                data = event.get("data")
-                parsed_url = None
-                parsed_url = None
-
-                if ev_type == "on_chain_end":
-                    node = event.get("name")
-                    print(f"[event_stream] 收到 on_chain_end event: {node} {event}")
-
-                elif ev_type == "on_chain_stream":
-                    #print(f"[event_stream] 收到 on_chain_stream event: {event}")
-                    metadata = event.get("metadata")
-                    node = event.get("name")
-                    if node not in {"agent", "summarize"}:
-                        print(f"[event_stream] node 不是 agent, summarize : {node}")
-                        continue
-                    data = event.get("data")
-
-                    print(f"[event_stream] data: {node}: {data}")
-                    if not isinstance(data, dict):
-                        data = {}
-                    
-                    # Handle chunk_obj extraction safely
-                    chunk_obj = None
-                    try:
-                        chunk_obj = data.get("chunk") if isinstance(data, dict) else None
-                    except (AttributeError, TypeError) as e:
-                        print(f"[event_stream] Error getting chunk_obj: {e}")
-                        chunk_obj = None
-                    
-                    if chunk_obj and hasattr(chunk_obj, "content") and chunk_obj.content:
-                        #print(f"[event_stream] 收到 chunk_obj: {chunk_obj.content}")
-                        yield f"{chunk_obj.content}"
-                    elif isinstance(chunk_obj, dict):
-                        msg = None
-                        try:
-                            if "messages" in chunk_obj:
-                                msg = chunk_obj.get("messages")
-                            elif "agent" in chunk_obj and isinstance(chunk_obj.get("agent"), dict):
-                                msg = chunk_obj.get("agent", {}).get("messages")
-                        except (AttributeError, TypeError) as e:
-                            print(f"[event_stream] Error getting messages from chunk_obj: {e}")
-                            msg = None
-
-                        # Handle different message types
-                        if msg:
-                            # If msg is a single message object
-                            if hasattr(msg, "content"):
-                                if isinstance(msg.content, str) and msg.content:
-                                    print(f"[event_stream] 输出消息内容 (单条): {msg.content[:100]}...")
-                                    yield f"{msg.content}"
-                                elif isinstance(msg.content, list):
-                                    # Handle list content
-                                    for content_item in msg.content:
-                                        if isinstance(content_item, str) and content_item:
-                                            print(f"[event_stream] 输出消息内容 (列表项): {content_item[:100]}...")
-                                            yield f"{content_item}"
-                            # If msg is a list of messages
-                            elif isinstance(msg, list):
-                                for m in msg:
-                                    if hasattr(m, "content"):
-                                        if isinstance(m.content, str) and m.content:
-                                            print(f"[event_stream] 输出消息内容 (列表): {m.content[:100]}...")
-                                            yield f"{m.content}"
-                                        elif isinstance(m.content, list):
-                                            for content_item in m.content:
-                                                if isinstance(content_item, str) and content_item:
-                                                    print(f"[event_stream] 输出消息内容 (列表中的列表项): {content_item[:100]}...")
-                                                    yield f"{content_item}"
-        except Exception as e:
-            print(ev_type)
-            print(f"[event_stream] Exception: {e}")
-            yield f"error: {str(e)}\n\n"
-        print(f"[event_stream] 正常结束 original_query={original_query} thread_id={thread_id}")
-
-    print(f"[perform_query] 被调用 original_query={original_query} thread_id={thread_id}")
+        logger.info("[event_stream] 开始 original_query=%s dataset_id=%s user_id=%s thread_id=%s",
+                    capped(original_query, 200), dataset_id, user_id, thread_id)
+        with request_trace("/query/", thread_id=thread_id) as trace:
+            try:
+                # only answer text reaches here: model deltas as they arrive, or whole answers that were not streamed
+                async for event in run_chat_stream(original_query, dataset_id, user_id, thread_id, do_web_search, use_cache):
+                    yield event.text
+            except Exception as e:
+                trace.fail(e)
+                logger.exception("[event_stream] thread_id=%s failed", thread_id)
+                yield f"error: {str(e)}\n\n"
+        logger.debug("[event_stream] 正常结束 thread_id=%s", thread_id)
+
     try:
-        response = StreamingResponse(event_stream(), media_type="text/event-stream")
-        print("[perform_query] 返回 StreamingResponse")
-        return response
+        return StreamingResponse(timed_stream(event_stream(), thread_id), media_type="text/event-stream")
     except Exception as e:
-        print(f"[perform_query] Exception: {e}")
+        logger.exception("[perform_query] thread_id=%s failed", thread_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -230,7 +285,7 @@ if __name__ == "__main__":
         allow_methods=["*"],
         allow_headers=["*"],
     )
-    print("CORS is enabled.")
+    logger.info("CORS is enabled.")
     # else:
     #     print("CORS is disabled.")
     uvicorn.run(app, host="0.0.0.0", port=8191)
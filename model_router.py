@@ -0,0 +1,221 @@
+"""
+Per-call model routing. Each task type (final answer, summary, intent detection) has candidate models in order
+of preference. A candidate is skipped when its circuit breaker is open, when the input is larger than it accepts,
+or when its recent p99 latency on the task misses the task's latency SLO while another candidate is left.
+A call that fails on the chosen model is retried on the next candidate. A streamed call is only retried while
+nothing was streamed yet, and its timeout applies to the first chunk, not to the whole generation.
+
+Latencies are kept per task and model, separately for whole calls (compared with the SLO, and the timeout of
+calls that are not streamed) and for the first chunk of streamed calls (their timeout).
+
+Models are registered under roles ("strong", "fast") by utils.init_models, so providers can be swapped there.
+"""
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, message_chunk_to_message
+
+from context_budget import count_tokens, prompt_usage
+from logger import logger
+from resilience import breaker, latency_p99
+from tool_executor import parse_overrides
+from tracing import LatencyHistogram, metrics, span
+from utils import get_message_text
+
+# task -> candidate roles, most preferred first, e.g. ROUTER_ROUTES="answer=strong|fast,summary=fast|strong"
+ROUTER_ROUTES = {
+    "answer": ["strong", "fast"],
+    "summary": ["fast", "strong"],
+    "intent": ["fast"],
+}
+ROUTER_ROUTES.update({task: roles.split("|") for task, roles in
+                      parse_overrides(os.getenv("ROUTER_ROUTES", ""), str).items()})
+# latency SLO of a call per task in seconds, e.g. ROUTER_SLO="answer=20,summary=30"
+ROUTER_SLO = {"answer": 20.0, "summary": 30.0, "intent": 5.0}
+ROUTER_SLO.update(parse_overrides(os.getenv("ROUTER_SLO", ""), float))
+# largest input in tokens a role is routed, e.g. ROUTER_MAX_INPUT_TOKENS="fast=100000"
+ROUTER_MAX_INPUT_TOKENS = parse_overrides(os.getenv("ROUTER_MAX_INPUT_TOKENS", ""), int)
+# price per 1000 input / output tokens for the cost log, e.g. ROUTER_PRICES="strong=0.0008:0.002,fast=0.0003:0.0006"
+ROUTER_PRICES = {
+    role: tuple(float(p) for p in prices.split(":"))
+    for role, prices in parse_overrides(
+        os.getenv("ROUTER_PRICES", "strong=0.0008:0.002,fast=0.0003:0.0006"), str).items()
+}
+
+
+class RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.latency = LatencyHistogram()
+        self.total = deque(maxlen=200)  # recent whole-call latencies
+        self.first_chunk = deque(maxlen=200)  # recent latencies to the first chunk of streamed calls
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost": self.cost,
+            "latency": self.latency.snapshot(),
+            "p99_s": latency_p99(self.total),
+            "first_chunk_p99_s": latency_p99(self.first_chunk),
+        }
+
+
+class ModelRouter:
+    """
+    Pick a model per call by task type, input size, latency SLO and current model latency.
+
+    Args:
+        models (Dict[str, BaseChatModel]): Model per role.
+        routes (dict): Candidate roles per task, most preferred first.
+        slo (dict): Latency SLO in seconds per task.
+        max_input_tokens (dict): Largest input in tokens per role, unlimited for the others.
+
+    Raises:
+        ValueError: A task has no registered model to route to, e.g. after a misconfigured ROUTER_ROUTES.
+    """
+
+    def __init__(self, models: Dict[str, BaseChatModel], routes: Optional[dict] = None, slo: Optional[dict] = None,
+                 max_input_tokens: Optional[dict] = None):
+        self.models = models
+        self.routes = ROUTER_ROUTES if routes is None else routes
+        self.slo = ROUTER_SLO if slo is None else slo
+        self.max_input_tokens = ROUTER_MAX_INPUT_TOKENS if max_input_tokens is None else max_input_tokens
+        if "answer" not in self.routes:
+            raise ValueError("ROUTER_ROUTES has no route for the answer task, which unknown tasks use")
+        for task, roles in self.routes.items():
+            if not any(role in models for role in roles):
+                raise ValueError(f"ROUTER_ROUTES for task {task!r} names no registered model: {roles} "
+                                 f"(registered: {sorted(models)})")
+        self._bound = {}  # (role, tool names) -> model with the tools bound
+        self.stats = {}  # (task, role) -> RouteStats
+
+    @staticmethod
+    def breaker(role: str):
+        return breaker(f"model_{role}")
+
+    def _model(self, role: str, tools: Optional[Sequence] = None):
+        if not tools:
+            return self.models[role]
+        key = (role, tuple(t.name for t in tools))
+        if key not in self._bound:
+            self._bound[key] = self.models[role].bind_tools(list(tools))
+        return self._bound[key]
+
+    def candidates(self, task: str, input_tokens: int) -> List[tuple]:
+        """(role, reason) in the order they will be tried."""
+        roles = [r for r in self.routes.get(task, self.routes["answer"]) if r in self.models]
+        slo = self.slo.get(task)
+        within_slo, over_slo = [], []
+        for role in roles:
+            if input_tokens > self.max_input_tokens.get(role, input_tokens):
+                continue
+            if self.breaker(role).state == "open":
+                continue
+            stats = self.stats.get((task, role))
+            p99 = latency_p99(stats.total) if stats is not None else None
+            if slo is not None and p99 is not None and p99 > slo:
+                over_slo.append((role, f"p99 {p99:.1f}s over the {slo}s SLO"))
+            else:
+                within_slo.append((role, "preferred" if not within_slo else "fallback"))
+        # a model over its SLO is still better than no model
+        return within_slo + over_slo or [(roles[-1], "last resort")]
+
+    async def _stream(self, task: str, role: str, model, messages: list, stats: RouteStats):
+        """
+        Stream model on messages and return the whole message. The breaker's timeout applies to the first chunk;
+        once a chunk was produced, a failure returns the partial answer (marked partial, without tool calls).
+        """
+        chunks = model.astream(messages)
+        role_breaker = self.breaker(role)
+        try:
+            start = time.perf_counter()
+            message = await role_breaker.call(anext, chunks, None,
+                                              timeout=role_breaker.timeout_for(latency_p99(stats.first_chunk)))
+            stats.first_chunk.append(time.perf_counter() - start)
+            if message is None:
+                return AIMessage(content="")
+            try:
+                async for chunk in chunks:
+                    message = message + chunk
+            except Exception as e:
+                # the deltas already reached the client: retrying on another model would repeat the answer
+                role_breaker.record_failure()
+                logger.warning("[ModelRouter] task=%s model=%s failed mid-stream, ending with the partial answer: %r",
+                               task, role, e)
+                # same id as the streamed deltas, so the graph's "messages" stream mode does not emit it again
+                return AIMessage(content=get_message_text(message), id=message.id, response_metadata={"partial": True})
+            return message_chunk_to_message(message)
+        finally:
+            await chunks.aclose()
+
+    async def ainvoke(self, task: str, messages: list, tools: Optional[Sequence] = None,
+                      input_tokens: Optional[int] = None, stream: bool = False):
+        """
+        Invoke the routed model on messages, falling back to the next candidate on failure.
+
+        Args:
+            stream (bool): Stream the model, so the graph's "messages" stream mode sees the deltas. The timeout
+                then bounds the time to the first chunk, and there is no fallback once a chunk was produced.
+
+        Raises:
+            CircuitOpenError, asyncio.TimeoutError or the model's error: All candidates failed.
+        """
+        if input_tokens is None:
+            input_tokens = sum(count_tokens(get_message_text(m)) for m in messages)
+        error = None
+        for role, reason in self.candidates(task, input_tokens):
+            stats = self.stats.setdefault((task, role), RouteStats())
+            stats.calls += 1
+            start = time.perf_counter()
+            with span("llm", task, model=role, route=reason) as llm_span:
+                try:
+                    if stream:
+                        response = await self._stream(task, role, self._model(role, tools), messages, stats)
+                    else:
+                        role_breaker = self.breaker(role)
+                        response = await role_breaker.call(self._model(role, tools).ainvoke, messages,
+                                                           timeout=role_breaker.timeout_for(latency_p99(stats.total)))
+                except Exception as e:
+                    llm_span.fail(e)
+                    stats.failures += 1
+                    logger.warning("[ModelRouter] task=%s model=%s failed after %.2fs: %r", task, role,
+                                   time.perf_counter() - start, e)
+                    error = e
+                    continue
+                latency = time.perf_counter() - start
+                usage = prompt_usage(response)
+                used_input = usage[0] if usage else input_tokens
+                output_tokens = (getattr(response, "usage_metadata", None) or {}).get("output_tokens") \
+                    or count_tokens(get_message_text(response))
+                llm_span.set("input_tokens", used_input)
+                llm_span.set("output_tokens", output_tokens)
+                llm_span.set("cached_tokens", usage[1] if usage else 0)
+            stats.latency.observe(latency)
+            stats.total.append(latency)
+            for kind, tokens in (("input", used_input), ("output", output_tokens), ("cached", usage[1] if usage else 0)):
+                metrics.inc("chat_llm_tokens_total", tokens, "Model tokens by task, model and kind",
+                            task=task, model=role, kind=kind)
+            price_in, price_out = ROUTER_PRICES.get(role, (0.0, 0.0))
+            cost = used_input / 1000 * price_in + output_tokens / 1000 * price_out
+            stats.input_tokens += used_input
+            stats.output_tokens += output_tokens
+            stats.cost += cost
+            metrics.inc("chat_llm_cost_total", cost, "Model cost by task and model, in ROUTER_PRICES units",
+                        task=task, model=role)
+            logger.info("[ModelRouter] task=%s model=%s (%s) input_tokens=%d output_tokens=%d latency=%.2fs cost=%.5f",
+                        task, role, reason, used_input, output_tokens, latency, cost)
+            return response
+        raise error
+
+    def snapshot(self) -> dict:
+        return {f"{task}:{role}": stats.snapshot() for (task, role), stats in self.stats.items()}
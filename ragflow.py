@@ -1,9 +1,16 @@
+import asyncio
+import hashlib
 import uuid
 from typing import List, Optional, Union
 
+import httpx
 import numpy as np
 import os
-import requests
+from dotenv import load_dotenv
+from logger import logger
+from resilience import breaker
+
+load_dotenv()
 
 DEFAULT_COLLECTION_NAME = "deepsearcher"
 
@@ -12,69 +19,136 @@ REFERENCE_PAYLOAD_KEY = "reference"
 METADATA_PAYLOAD_KEY = "metadata"
 
 
+RAGFLOW_BASE_URL = os.getenv("RAGFLOW_BASE_URL", "http://117.50.221.99:8080")
+RAGFLOW_CONNECT_TIMEOUT = float(os.getenv("RAGFLOW_CONNECT_TIMEOUT", "3"))
+RAGFLOW_READ_TIMEOUT = float(os.getenv("RAGFLOW_READ_TIMEOUT", "15"))
+RAGFLOW_MAX_CONNECTIONS = int(os.getenv("RAGFLOW_MAX_CONNECTIONS", "32"))
+# max requests in flight to the Ragflow server from this worker
+RAGFLOW_MAX_CONCURRENCY = int(os.getenv("RAGFLOW_MAX_CONCURRENCY", "16"))
+RAGFLOW_SIMILARITY_THRESHOLD = float(os.getenv("RAGFLOW_SIMILARITY_THRESHOLD", "0.2"))
+
+
+def split_dataset_ids(ds_ids: str) -> List[str]:
+    """'a, b,a' -> ['a', 'b']"""
+    return list(dict.fromkeys(d.strip() for d in (ds_ids or "").split(",") if d.strip()))
+
+
+def merge_chunks(chunk_lists: List[List[dict]], top_k: int) -> List[dict]:
+    """Merge per-dataset chunk lists by similarity, dropping repeated chunk ids and identical contents."""
+    merged = sorted((c for chunks in chunk_lists for c in chunks), key=lambda c: c.get("similarity", 0.0), reverse=True)
+    seen = set()
+    results = []
+    for chunk in merged:
+        content_hash = hashlib.sha1(" ".join(chunk.get("content", "").split()).encode("utf-8")).hexdigest()
+        if content_hash in seen or (chunk.get("id") and chunk["id"] in seen):
+            continue
+        seen.add(content_hash)
+        if chunk.get("id"):
+            seen.add(chunk["id"])
+        results.append(chunk)
+        if len(results) >= top_k:
+            break
+    return results
+
+
 class Ragflow(): 
-    """Vector DB implementation powered by [Ragflow](https://ragflow.com/)"""
-    
-    def search_data(
+    """Vector DB implementation powered by [Ragflow](https://ragflow.com/), async with a pooled keep-alive client"""
+
+    def __init__(
+        self,
+        base_url: str = RAGFLOW_BASE_URL,
+        api_key: Optional[str] = None,
+        connect_timeout: float = RAGFLOW_CONNECT_TIMEOUT,
+        read_timeout: float = RAGFLOW_READ_TIMEOUT,
+        max_connections: int = RAGFLOW_MAX_CONNECTIONS,
+        max_concurrency: int = RAGFLOW_MAX_CONCURRENCY,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key or os.getenv("RAGFlow_API_KEY", "ragflow-kzZTdhZDE2YjNjYTExZjA4ZTc4MjI3MT")
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+        return self._client
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await breaker("ragflow").call(self._send, method, path, **kwargs)
+
+    async def _send(self, method: str, path: str, **kwargs) -> httpx.Response:
+        response = await self.client.request(method, path, **kwargs)
+        if response.status_code >= 500:
+            # server errors count against the breaker, 4xx are the caller's fault
+            response.raise_for_status()
+        return response
+
+    async def retrieve(
         self,
         ds_id: str,
+        question: str,
         top_k: int = 5,
-        question: str = "Search query",
-    ) -> List[str]:
+        similarity_threshold: float = RAGFLOW_SIMILARITY_THRESHOLD,
+    ) -> List[dict]:
         """
-        Search for similar vectors in a Ragflow collection.
+        Retrieve the top_k chunks of one dataset, best first.
 
         Args:
-            ds_id (Optional[str]): Dataset id.
-            vector (Union[np.array, List[float]]): Query vector for similarity search.
-            top_k (int, optional): Number of results to return. Defaults to 5.
+            ds_id (str): Dataset id.
+            question (str): Query text for similarity search.
+            top_k (int, optional): Number of chunks to return. Defaults to 5.
+            similarity_threshold (float, optional): Chunks scoring below it are dropped by the server.
 
         Returns:
-            List[str]: List of retrieval results containing similar vectors.
+            List[dict]: Chunks as {"id", "content", "similarity", "dataset_id", "document"}.
         """
+        if not ds_id:
+            logger.warning("[Ragflow] retrieve called without dataset_id")
+            return []
         try:
-            
-            if not ds_id:
-                print(f"no dataset_id")
-                return []
-            
-            address = "117.50.221.99:8080"
-            api_key = os.getenv("RAGFlow_API_KEY", "ragflow-kzZTdhZDE2YjNjYTExZjA4ZTc4MjI3MT")
-            url = f"http://{address}/api/v1/retrieval"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            }
-            
             payload = {
                 "question": question,
                 "dataset_ids": [ds_id],
-                #"document_ids": ["77df9ef4759a11ef8bdd0242ac120004"]
+                "page": 1,
+                "page_size": top_k,
+                "similarity_threshold": similarity_threshold,
             }
-            #print(payload)
-            response = requests.post(url, headers=headers, json=payload)
+            response = await self._request("POST", "/api/v1/retrieval", json=payload)
             if response.status_code != 200:
                 raise Exception(f"Ragflow search failed: {response.text}")
             
             response_data = response.json()
-            #print(response_data)
             results = []
             
             if response_data.get("code") == 0 and "data" in response_data:
-                data = response_data["data"]
-                if "chunks" in data:
-                    for chunk in data["chunks"]:
-                        #print(chunk)
-                        results.append(chunk.get("content", ""))
-            #print(results)
-            return results
+                for chunk in response_data["data"].get("chunks", []):
+                    results.append({
+                        "id": chunk.get("id", ""),
+                        "content": chunk.get("content", ""),
+                        "similarity": float(chunk.get("similarity") or 0.0),
+                        "dataset_id": chunk.get("dataset_id", ds_id),
+                        "document": chunk.get("document_keyword") or chunk.get("document_id", ""),
+                    })
+            return results[:top_k]
         except Exception as e:
-            print(f"Failed to search data, error info: {e}")
+            logger.error("[Ragflow] retrieval from %s failed: %r", ds_id, e)
             return []
 
-    def list_collections(self, *args, **kwargs) -> List[dict]:
+    async def list_collections(self, *args, **kwargs) -> List[dict]:
         """
-        List all collections in the Qdrant database.
+        List all datasets in the Ragflow server.
 
         Args:
             *args: Variable length argument list.
@@ -85,16 +159,13 @@ class Ragflow():
         """
 
         try:
-            address = "117.50.221.99:8080"
             page = 1
             page_size = 100
             orderby = "update_time"
             desc = "true"
             dataset_name = ""
             dataset_id = ""
-            api_key = os.getenv("RAGFlow_API_KEY", "ragflow-kzZTdhZDE2YjNjYTExZjA4ZTc4MjI3MT")
 
-            # Build URL with only non-empty parameters
             params = {
                 "page": page,
                 "page_size": page_size,
@@ -109,31 +180,34 @@ class Ragflow():
             if dataset_id:
                 params["id"] = dataset_id
                 
-            # Build query string
-            query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-            url = f"http://{address}/api/v1/datasets?{query_string}"
-            headers = {
-                "Authorization": f"Bearer {api_key}"
-            }
-            response = requests.get(url, headers=headers)
-            #print(response.status_code, response.text)
+            response = await self._request("GET", "/api/v1/datasets", params=params)
             if response.status_code == 200:
                 datasets = response.json().get("data", [])
             else:
-                log.critical(f"Failed to fetch collections, status code: {response.status_code}, response: {response.text}")
+                logger.critical("Failed to fetch collections, status code: %s, response: %s", response.status_code, response.text)
                 datasets = []
             
             results = []
             for dataset in datasets:
-                # Check if CollectionInfo accepts dataset_id parameter
-                results.append({"name": dataset["name"], "id": dataset["id"], "description": dataset["description"]})
+                results.append({"name": dataset["name"], "id": dataset["id"], "description": dataset.get("description")})
             return results
         except Exception as e:
-            log.critical(f"Failed to list collections, error info: {e}")
+            logger.critical("Failed to list collections, error info: %s", e)
             return []
 
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
 if __name__ == "__main__":
     ragflow = Ragflow()
-    #print(ragflow.list_collections())
-    print(ragflow.search_data(ds_id="4b8c848eb31011f08b4c22715a4cef8f", top_k=5, question="需要确认的事项"))
-    #print(ragflow.search_data(ds_id="25b4fb90b30d11f0bdca22715a4cef8f", top_k=5, question="有哪些机会"))
\ No newline at end of file
+    #print(asyncio.run(ragflow.list_collections()))
+
+    async def demo(ds_ids: str, question: str, top_k: int = 5) -> List[str]:
+        chunk_lists = await asyncio.gather(*(ragflow.retrieve(ds_id, question, top_k) for ds_id in split_dataset_ids(ds_ids)))
+        await ragflow.aclose()
+        return [chunk["content"] for chunk in merge_chunks(chunk_lists, top_k)]
+
+    print(asyncio.run(demo("4b8c848eb31011f08b4c22715a4cef8f", "需要确认的事项")))
+    #print(asyncio.run(demo("25b4fb90b30d11f0bdca22715a4cef8f", "有哪些机会")))
\ No newline at end of file
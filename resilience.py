@@ -0,0 +1,186 @@
+"""
+Circuit breakers with adaptive timeouts, one per external dependency (ragflow, bocha, serper, tavily, redis, and
+one per model role of the model router: model_strong, model_fast).
+
+closed:    calls go through; `failure_threshold` consecutive failures open the breaker
+open:      calls are rejected immediately for `recovery_time` seconds
+half_open: up to `half_open_max_calls` probe calls go through; a success closes the breaker, a failure reopens it
+
+The timeout of a call follows the dependency's recent p99 latency (times `timeout_multiplier`),
+clamped to [min_timeout, max_timeout]; until enough samples exist max_timeout is used.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+from logger import logger
+from tracing import span
+
+
+def latency_p99(latencies, min_samples: int = 20) -> Optional[float]:
+    """p99 of recent latencies, None until there are min_samples of them."""
+    if len(latencies) < min_samples:
+        return None
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name: str):
+        super().__init__(f"circuit breaker for {name} is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_time: float = 30,
+        half_open_max_calls: int = 1,
+        min_timeout: float = 1,
+        max_timeout: float = 30,
+        timeout_multiplier: float = 1.5,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.half_open_max_calls = half_open_max_calls
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.recovery_time:
+            self._state = "half_open"
+            self._half_open_calls = 0
+            logger.info("[CircuitBreaker] %s half-open, probing", self.name)
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; counts a half-open probe slot when it does."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self, latency: Optional[float] = None):
+        self.successes += 1
+        if latency is not None:
+            self.latencies.append(latency)
+        self._consecutive_failures = 0
+        if self._state != "closed":
+            logger.info("[CircuitBreaker] %s closed", self.name)
+        self._state = "closed"
+
+    def record_failure(self):
+        self.failures += 1
+        self._consecutive_failures += 1
+        if self._state == "half_open" or (
+            self._state == "closed" and self._consecutive_failures >= self.failure_threshold
+        ):
+            logger.warning("[CircuitBreaker] %s open after %d consecutive failures", self.name, self._consecutive_failures)
+            self._state = "open"
+            self._opened_at = time.monotonic()
+
+    def p99(self) -> Optional[float]:
+        return latency_p99(self.latencies, self.min_samples)
+
+    def timeout(self) -> float:
+        return self.timeout_for(self.p99())
+
+    def timeout_for(self, p99: Optional[float]) -> float:
+        """The adaptive timeout for calls with this p99 latency, for callers that keep latencies per call type."""
+        if p99 is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Await fn(*args, **kwargs) under the breaker and the adaptive timeout.
+
+        Raises:
+            CircuitOpenError: The breaker is open, fn was not called.
+            asyncio.TimeoutError: fn took longer than the timeout (counted as a failure).
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        start = time.perf_counter()
+        try:
+            with span("dependency", self.name):
+                result = await asyncio.wait_for(fn(*args, **kwargs), timeout or self.timeout())
+        except asyncio.CancelledError:
+            # cancelled by the caller (e.g. a hedged search that another provider won): not the dependency's fault
+            if self._state == "half_open":
+                self._half_open_calls -= 1
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(time.perf_counter() - start)
+        return result
+
+    def snapshot(self) -> dict:
+        p99 = self.p99()
+        return {
+            "state": self.state,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "p99_ms": p99 * 1000 if p99 is not None else None,
+            "timeout_s": self.timeout(),
+        }
+
+
+# per-dependency settings, overridable with BREAKER_<NAME>_<SETTING>, e.g. BREAKER_RAGFLOW_MAX_TIMEOUT=10
+_DEFAULTS = {
+    "ragflow": {"max_timeout": 15, "min_timeout": 2},
+    "bocha": {"max_timeout": 5, "min_timeout": 1},
+    "serper": {"max_timeout": 5, "min_timeout": 1},
+    "tavily": {"max_timeout": 10, "min_timeout": 2},
+    "model_strong": {"max_timeout": 120, "min_timeout": 30, "failure_threshold": 3},
+    "model_fast": {"max_timeout": 60, "min_timeout": 15, "failure_threshold": 3},
+    # a single Redis failure switches to the SQLite fallback, as before
+    "redis": {"max_timeout": 2, "min_timeout": 0.2, "failure_threshold": 1,
+              "recovery_time": float(os.getenv("REDIS_RECONNECT_INTERVAL", "5"))},
+}
+_SETTINGS = ("failure_threshold", "recovery_time", "half_open_max_calls", "min_timeout", "max_timeout",
+             "timeout_multiplier")
+
+_breakers = {}
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """The shared breaker of a dependency, created on first use."""
+    if name not in _breakers:
+        settings = dict(_DEFAULTS.get(name, {}))
+        for setting in _SETTINGS:
+            value = os.getenv(f"BREAKER_{name.upper()}_{setting.upper()}")
+            if value is not None:
+                settings[setting] = int(value) if setting in ("failure_threshold", "half_open_max_calls") else float(value)
+        _breakers[name] = CircuitBreaker(name, **settings)
+    return _breakers[name]
+
+
+def breaker_stats() -> dict:
+    return {name: b.snapshot() for name, b in _breakers.items()}
@@ -0,0 +1,133 @@
+"""
+Cache of Ragflow retrieval results (per-dataset ranked chunks) keyed on (dataset_id, normalized question, top_k).
+An in-process LRU/TTL tier in front of an optional Redis tier shared by all workers.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import List, Optional
+
+from bounded_cache import BoundedCache
+from logger import logger
+from session_store import session_store
+
+RAG_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "300"))
+RAG_CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "5000"))
+RAG_CACHE_MAX_BYTES = int(os.getenv("RAG_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# shared tier: off unless RAG_CACHE_REDIS=1
+RAG_CACHE_REDIS = os.getenv("RAG_CACHE_REDIS", "0") == "1"
+RAG_CACHE_REDIS_TTL = int(os.getenv("RAG_CACHE_REDIS_TTL", "3600"))
+RAG_CACHE_REDIS_MAX_ENTRIES = int(os.getenv("RAG_CACHE_REDIS_MAX_ENTRIES", "20000"))
+
+_TRAILING_PUNCT = re.compile(r"[\s?？!！。.,，;；:：~]+$")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Fold width/case/whitespace and trailing punctuation so trivially rephrased questions share a key."""
+    question = unicodedata.normalize("NFKC", question or "").lower().strip()
+    question = _SPACES.sub(" ", question)
+    return _TRAILING_PUNCT.sub("", question)
+
+
+class RetrievalCache:
+    """Two-tier retrieval cache with per-dataset invalidation and hit-ratio counters."""
+
+    def __init__(self, use_redis: bool = RAG_CACHE_REDIS):
+        self.local = BoundedCache(max_entries=RAG_CACHE_MAX_ENTRIES, max_bytes=RAG_CACHE_MAX_BYTES, ttl=RAG_CACHE_TTL)
+        self.use_redis = use_redis
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @staticmethod
+    def _field(question: str, top_k: int) -> str:
+        return hashlib.sha1(f"{top_k}:{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _redis_key(dataset_id: str) -> str:
+        # one hash per dataset so invalidating a dataset is a single DEL
+        return f"rag:chunks:{dataset_id}"
+
+    async def get(self, dataset_id: str, question: str, top_k: int) -> Optional[List[dict]]:
+        field = self._field(question, top_k)
+        results = self.local.get((dataset_id, field))
+        if results is not None or not self.use_redis:
+            return results
+
+        client = await session_store.redis()
+        if client is None:
+            return None
+        try:
+            raw = await client.hget(self._redis_key(dataset_id), field)
+        except Exception as e:
+            logger.warning("[RetrievalCache] Redis get error for %s: %s", dataset_id, e)
+            session_store.mark_down(e)
+            return None
+        if raw is not None:
+            cached = json.loads(raw)
+            if time.time() - cached["t"] < RAG_CACHE_REDIS_TTL:
+                self.shared_hits += 1
+                self.local.set((dataset_id, field), cached["results"])
+                return cached["results"]
+        self.shared_misses += 1
+        return None
+
+    async def set(self, dataset_id: str, question: str, top_k: int, results: List[dict]):
+        field = self._field(question, top_k)
+        self.local.set((dataset_id, field), results)
+        if not self.use_redis:
+            return
+
+        client = await session_store.redis()
+        if client is None:
+            return
+        key = self._redis_key(dataset_id)
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.hset(key, field, json.dumps({"t": time.time(), "results": results}, ensure_ascii=False))
+                pipe.expire(key, RAG_CACHE_REDIS_TTL)
+                pipe.hlen(key)
+                _, _, size = await pipe.execute()
+            if size > RAG_CACHE_REDIS_MAX_ENTRIES:
+                # coarse bound: start the dataset over rather than track per-field age
+                await client.delete(key)
+        except Exception as e:
+            logger.warning("[RetrievalCache] Redis set error for %s: %s", dataset_id, e)
+            session_store.mark_down(e)
+
+    async def invalidate_dataset(self, dataset_id: str) -> int:
+        """
+        Drop cached results of a dataset after its documents changed.
+        Local tiers of other workers expire within RAG_CACHE_TTL.
+
+        Returns:
+            int: Number of local entries removed.
+        """
+        removed = self.local.pop_where(lambda key: key[0] == dataset_id)
+        if self.use_redis:
+            client = await session_store.redis()
+            if client is not None:
+                try:
+                    await client.delete(self._redis_key(dataset_id))
+                except Exception as e:
+                    logger.warning("[RetrievalCache] Redis invalidate error for %s: %s", dataset_id, e)
+                    session_store.mark_down(e)
+        return removed
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        shared_lookups = self.shared_hits + self.shared_misses
+        stats.update({
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+            "shared_hit_ratio": self.shared_hits / shared_lookups if shared_lookups else 0.0,
+        })
+        lookups = stats["hits"] + stats["misses"]
+        stats["overall_hit_ratio"] = (stats["hits"] + self.shared_hits) / lookups if lookups else 0.0
+        return stats
+
+
+retrieval_cache = RetrievalCache()
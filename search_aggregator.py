@@ -0,0 +1,96 @@
+"""
+Merge results of the knowledge base and web search providers into one deduplicated, ranked,
+size-budgeted context block for the model.
+"""
+import hashlib
+import os
+import re
+import textwrap
+from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+SEARCH_ALL_MAX_RESULTS = int(os.getenv("SEARCH_ALL_MAX_RESULTS", "8"))
+# budget of the whole block and of each result's text, in characters
+SEARCH_ALL_MAX_CHARS = int(os.getenv("SEARCH_ALL_MAX_CHARS", "4000"))
+SEARCH_ALL_SNIPPET_CHARS = int(os.getenv("SEARCH_ALL_SNIPPET_CHARS", "600"))
+
+_TRACKING_PARAMS = re.compile(r"^(utm_\w+|spm|from|ref|source|share_\w+|fbclid|gclid)$", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+ResultFormat = textwrap.dedent("""
+<search_result id={id} source={source}>
+<title>{title}</title>
+<time>{time}</time>
+<url>{url}</url>
+<summary>{summary}</summary>
+</search_result>
+""")
+
+
+def canonical_url(url: str) -> str:
+    """Lowercased host without www., no fragment, no tracking params, no trailing slash."""
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if not _TRACKING_PARAMS.match(k)))
+    return urlunsplit(("", host, parts.path.rstrip("/"), query, ""))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(_SPACES.sub(" ", text or "").strip().lower().encode("utf-8")).hexdigest()
+
+
+def aggregate_results(result_lists: List[List[dict]], max_results: int = SEARCH_ALL_MAX_RESULTS) -> List[dict]:
+    """
+    Interleave the per-source lists by rank (each list is already best first, earlier lists win ties)
+    and drop results whose canonical URL or text was already seen.
+
+    Args:
+        result_lists (List[List[dict]]): Results {"source", "title", "url", "snippet", "time"} per source.
+        max_results (int): Maximum number of results returned.
+
+    Returns:
+        List[dict]: Deduplicated results, best first.
+    """
+    seen = set()
+    results = []
+    depth = max((len(r) for r in result_lists), default=0)
+    for rank in range(depth):
+        for source_results in result_lists:
+            if rank >= len(source_results):
+                continue
+            result = source_results[rank]
+            keys = {content_hash(result.get("snippet", ""))}
+            url = canonical_url(result.get("url", ""))
+            if url:
+                keys.add(url)
+            if keys & seen:
+                continue
+            seen |= keys
+            results.append(result)
+            if len(results) >= max_results:
+                return results
+    return results
+
+
+def build_aggregated_context(results: List[dict], max_chars: int = SEARCH_ALL_MAX_CHARS,
+                             snippet_chars: int = SEARCH_ALL_SNIPPET_CHARS) -> str:
+    """Format results best first, trimming each snippet and stopping once max_chars is reached."""
+    blocks = []
+    total = 0
+    for result in results:
+        snippet = result.get("snippet", "")
+        if len(snippet) > snippet_chars:
+            snippet = snippet[:snippet_chars] + "..."
+        block = ResultFormat.format(
+            id=len(blocks) + 1, source=result.get("source", "web"), title=result.get("title", "N/A"),
+            time=result.get("time", "N/A"), url=result.get("url", "N/A"), summary=snippet,
+        )
+        if blocks and total + len(block) > max_chars:
+            break
+        blocks.append(block)
+        total += len(block)
+    return "\n".join(blocks)
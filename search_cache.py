@@ -0,0 +1,98 @@
+"""
+Web search result cache keyed on (provider, normalized query, topk, date window).
+Entries expire when the search window rolls over at local midnight, so a cached answer is never older
+than the window it was searched for. In-process tier first, then a Redis tier shared by all workers.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+
+from bounded_cache import BoundedCache
+from logger import logger
+from retrieval_cache import normalize_question
+from session_store import session_store
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "5000"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# upper bound on how long a result is served, even if the window is still current
+SEARCH_CACHE_MAX_TTL = int(os.getenv("SEARCH_CACHE_MAX_TTL", str(24 * 3600)))
+SEARCH_CACHE_REDIS = os.getenv("SEARCH_CACHE_REDIS", "1") == "1"
+
+
+def cache_key(provider: str, query: str, topk: int, start_date: str, end_date: str) -> str:
+    digest = hashlib.sha1(normalize_question(query).encode("utf-8")).hexdigest()
+    return f"search:{provider}:{topk}:{start_date}:{end_date}:{digest}"
+
+
+def ttl_until_rollover(trigger_date: str, now: Optional[datetime] = None) -> int:
+    """
+    Seconds until the window derived from trigger_date (YYYYMMDD) is replaced by the next day's window.
+
+    Windows of past trigger dates never change, they get the max TTL.
+    """
+    now = now or datetime.now()
+    rollover = datetime.strptime(trigger_date, "%Y%m%d") + timedelta(days=1)
+    remaining = int((rollover - now).total_seconds())
+    if remaining <= 0:
+        return SEARCH_CACHE_MAX_TTL
+    return max(1, min(remaining, SEARCH_CACHE_MAX_TTL))
+
+
+class SearchCache:
+    """Two-tier search result cache with hit counters."""
+
+    def __init__(self, use_redis: bool = SEARCH_CACHE_REDIS):
+        self.local = BoundedCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, max_bytes=SEARCH_CACHE_MAX_BYTES)
+        self.use_redis = use_redis
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    async def get_first(self, keys: List[str], ttl: int) -> Optional[Any]:
+        """Value of the first key (in priority order) cached in either tier, or None; shared hits are kept locally for ttl."""
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                return value
+        if not self.use_redis or not keys:
+            return None
+
+        client = await session_store.redis()
+        if client is None:
+            return None
+        try:
+            raw_values = await client.mget(keys)
+        except Exception as e:
+            logger.warning("[SearchCache] Redis get error: %s", e)
+            session_store.mark_down(e)
+            return None
+        for key, raw in zip(keys, raw_values):
+            if raw is not None:
+                self.shared_hits += 1
+                value = json.loads(raw)
+                self.local.set(key, value, ttl=ttl)
+                return value
+        self.shared_misses += 1
+        return None
+
+    async def set(self, key: str, value: Any, ttl: int):
+        self.local.set(key, value, ttl=ttl)
+        if not self.use_redis:
+            return
+        client = await session_store.redis()
+        if client is None:
+            return
+        try:
+            await client.set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+        except Exception as e:
+            logger.warning("[SearchCache] Redis set error: %s", e)
+            session_store.mark_down(e)
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        stats.update({"shared_hits": self.shared_hits, "shared_misses": self.shared_misses})
+        return stats
+
+
+search_cache = SearchCache()
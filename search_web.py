@@ -5,12 +5,17 @@ use bocha and serpapi to search web
 import sys
 import os
 import asyncio
-import requests
+import httpx
+import statistics
 import textwrap
+import time
+from collections import deque
 from pathlib import Path
 from datetime import datetime, timedelta
 from pydantic import BaseModel, Field
 from logger import logger
+from resilience import CircuitOpenError, breaker
+from search_cache import cache_key, search_cache, ttl_until_rollover
 import json
 
 from dotenv import load_dotenv
@@ -18,12 +23,40 @@ load_dotenv()
 
 sys.path.append(str(Path(__file__).parent.parent.resolve()))
 
-def ask_bocha(payload: dict, BOCHA_API_KEY: str) -> list:
+# API endpoints; overridable to point at local stand-ins (see benchmarks/stand_ins.py)
+BOCHA_URL = os.getenv("BOCHA_URL", "https://api.bochaai.com/v1/web-search")
+SERP_URL = os.getenv("SERP_URL", "https://google.serper.dev/search")
+# Providers in priority order, from: serper, bocha
+SEARCH_PROVIDERS = [p.strip() for p in os.getenv("SEARCH_PROVIDERS", "bocha").split(",") if p.strip()]
+# sequential: next provider only after the previous failed
+# hedged: next provider also starts once SEARCH_HEDGE_DELAY passed without a result
+# parallel: all providers start at once
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hedged")
+SEARCH_HEDGE_DELAY = float(os.getenv("SEARCH_HEDGE_DELAY", "1.0"))
+# latency budget per provider call in seconds, e.g. SEARCH_BUDGET_BOCHA=5
+SEARCH_BUDGETS = {
+    "serper": float(os.getenv("SEARCH_BUDGET_SERPER", "5")),
+    "bocha": float(os.getenv("SEARCH_BUDGET_BOCHA", "5")),
+}
+
+_client = None
+
+def _http_client() -> httpx.AsyncClient:
+    """Shared keep-alive client; per-call deadlines come from the provider budgets."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(10, connect=3))
+    return _client
+
+async def close_http_client():
+    if _client is not None:
+        await _client.aclose()
+
+async def ask_bocha(payload: dict, BOCHA_API_KEY: str) -> list:
     """
     Performs a search using the Bocha AI API.
     API Key must be provided as an argument.
     """
-    BOCHA_URL = "https://api.bochaai.com/v1/web-search"
     headers = {
         'Authorization': 'Bearer ' + BOCHA_API_KEY,
         'Content-Type': 'application/json'
@@ -47,7 +80,7 @@ def ask_bocha(payload: dict, BOCHA_API_KEY: str) -> list:
     }
 
     try:
-        response = requests.post(BOCHA_URL, headers=headers, json=bocha_payload, timeout=5)
+        response = await _http_client().post(BOCHA_URL, headers=headers, json=bocha_payload)
         response.raise_for_status()  # For non-200 responses
 
         response_data = response.json()
@@ -64,18 +97,17 @@ def ask_bocha(payload: dict, BOCHA_API_KEY: str) -> list:
             })
         return standardized_results
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Bocha API request failed: {e}")
-        return []
+    except httpx.HTTPError as e:
+        logger.error("Bocha API request failed: %s", e)
+        # re-raised so the provider's circuit breaker counts the failure
+        raise
 
 
-def ask_google(payload: dict, SERP_API_KEY: str) -> list:
+async def ask_google(payload: dict, SERP_API_KEY: str) -> list:
     """
     Performs a search using the SerpAPI (Google Search).
     API Key must be provided as an argument.
     """
-    SERP_URL = "https://google.serper.dev/search"
-
     try:
         start_date = payload.get("start_date")
         end_date = payload.get("end_date")
@@ -94,7 +126,7 @@ def ask_google(payload: dict, SERP_API_KEY: str) -> list:
             params["tbs"] = f"cdr:1,cd_min:{start_formatted},cd_max:{end_formatted}"
 
         payload = json.dumps(params)
-        response = requests.request("POST", SERP_URL, headers=headers, data=payload)
+        response = await _http_client().post(SERP_URL, headers=headers, content=payload)
         response.raise_for_status()
         data = response.json()
 
@@ -108,11 +140,11 @@ def ask_google(payload: dict, SERP_API_KEY: str) -> list:
                 "time": item.get("date", "")
             })
         
-        print(standardized_results)
+        logger.debug("[ask_google] %d results", len(standardized_results))
         return standardized_results
-    except requests.exceptions.RequestException as e:
-        logger.error(f"SerpAPI request failed: {e}")
-        return []
+    except httpx.HTTPError as e:
+        logger.error("SerpAPI request failed: %s", e)
+        raise
 
 
 
@@ -137,20 +169,131 @@ def build_search_result_context(results: list) -> str:
     return "\n".join(result_context)
 
 
+class ProviderStats:
+    """Per-provider call counts, wins (first good result of a search) and recent latencies."""
+
+    def __init__(self, window: int = 1000):
+        self.calls = 0
+        self.wins = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.rejected = 0  # skipped because the provider's circuit breaker is open
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "wins": self.wins,
+            "win_rate": self.wins / self.calls if self.calls else 0.0,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if len(latencies) >= 20 else None,
+        }
+
+
+provider_stats = {}
+
+def search_stats() -> dict:
+    return {name: stats.snapshot() for name, stats in provider_stats.items()}
+
+
+async def _call_provider(name: str, payload: dict, api_key: str) -> list:
+    ask = {"serper": ask_google, "bocha": ask_bocha}[name]
+    stats = provider_stats.setdefault(name, ProviderStats())
+    stats.calls += 1
+    provider_breaker = breaker(name)
+    # the budget caps the adaptive timeout, which tightens to the provider's recent p99
+    timeout = min(SEARCH_BUDGETS.get(name, 5), provider_breaker.timeout())
+    start = time.perf_counter()
+    try:
+        results = await provider_breaker.call(ask, payload, api_key, timeout=timeout)
+    except CircuitOpenError:
+        stats.rejected += 1
+        return []
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+        logger.warning("%s search exceeded its %.2fs timeout.", name, timeout)
+        return []
+    except asyncio.CancelledError:
+        stats.cancelled += 1
+        raise
+    except Exception as e:
+        stats.errors += 1
+        logger.error("%s search failed: %s", name, e)
+        return []
+    stats.latencies.append(time.perf_counter() - start)
+    if not results:
+        stats.errors += 1
+    return results
+
+
+async def hedged_search(providers: list, payload: dict, mode: str = SEARCH_MODE,
+                        hedge_delay: float = SEARCH_HEDGE_DELAY) -> tuple:
+    """
+    Return the first non-empty result of the providers, cancelling the ones still running.
+
+    Args:
+        providers (list): (name, api_key) in priority order.
+        payload (dict): The search payload shared by all providers.
+        mode (str): "sequential", "hedged" or "parallel".
+        hedge_delay (float): Seconds to wait on a provider before also starting the next one in hedged mode.
+
+    Returns:
+        tuple: (standardized results, name) of the winning provider, ([], None) if all failed.
+    """
+    queue = list(providers)
+    running = {}
+
+    def _start(name: str, api_key: str):
+        logger.info("Attempting search with %s for query: '%s'", name, payload.get("query"))
+        running[asyncio.create_task(_call_provider(name, payload, api_key))] = name
+
+    try:
+        if queue:
+            _start(*queue.pop(0))
+        while mode == "parallel" and queue:
+            _start(*queue.pop(0))
+        while running:
+            wait_for_next = hedge_delay if (mode == "hedged" and queue) else None
+            done, _ = await asyncio.wait(running, timeout=wait_for_next, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # the running provider is slow: start the next one alongside it
+                _start(*queue.pop(0))
+                continue
+            for task in done:
+                name = running.pop(task)
+                results = task.result()
+                if results:
+                    provider_stats[name].wins += 1
+                    return results, name
+            # a provider failed: fall back right away instead of waiting for the hedge delay
+            if queue:
+                _start(*queue.pop(0))
+    finally:
+        for task in running:
+            task.cancel()
+    return [], None
+
+
 class SearchWebInput(BaseModel):
     query: str = Field(description="The search keywords, separate with empty space. Simple specific keywords. No more than 3 keywords.")
     topk: int = Field(default=3, description="The number of top results to return, default is 3")
     trigger_time: str = Field(description="The trigger time of the search. Format: YYYY-MM-DD HH:MM:SS.")
 
 
-async def search_web(query: str, topk: int = 3, trigger_time: str = None):
+async def search_web_results(query: str, topk: int = 3, trigger_time: str = None) -> list:
     """
-    Main tool function that orchestrates the search process with a fallback mechanism.
-    This tool's signature is compatible with the Pydantic model for LangChain.
+    Search the configured providers (cached, hedged) and return the standardized results
+    [{"title", "snippet", "url", "time"}], empty on failure.
     """
     if not trigger_time:
         logger.error("Search failed: 'trigger_time' is a mandatory parameter for this tool.")
-        return ""
+        return []
 
     trigger_date = trigger_time.split(" ")[0].replace("-", "")
     start_time = (datetime.strptime(trigger_date, "%Y%m%d") - timedelta(days=30)).strftime("%Y%m%d")
@@ -161,32 +304,39 @@ async def search_web(query: str, topk: int = 3, trigger_time: str = None):
         "start_date": start_time, "end_date": end_time
     }
 
-    response = []
-    serp_api_key = None #os.getenv("SERP_API_KEY")
-    bocha_api_key = os.getenv("BOCHA_API_KEY")
+    api_keys = {"serper": os.getenv("SERP_API_KEY"), "bocha": os.getenv("BOCHA_API_KEY")}
+    providers = [(name, api_keys.get(name)) for name in SEARCH_PROVIDERS if api_keys.get(name)]
 
-    if not serp_api_key and not bocha_api_key:
-        logger.warning("No search API keys (SERP_API_KEY, BOCHA_API_KEY) are configured.")
-        return ""
+    if not providers:
+        logger.warning("No search API keys (SERP_API_KEY, BOCHA_API_KEY) are configured for SEARCH_PROVIDERS.")
+        return []
 
-    # Priority 1: Try Google Search
-    if serp_api_key:
-        logger.info(f"Attempting search with Google (SerpAPI) for query: '{query}'")
-        response = ask_google(payload, serp_api_key)
-    
-    # Priority 2: Fallback to Bocha if the first attempt fails
-    if not response and bocha_api_key:
-        logger.warning("Google search failed or was not configured. Falling back to Bocha AI.")
-        logger.info(f"Attempting search with Bocha AI for query: '{query}'")
-        response = ask_bocha(payload, bocha_api_key)
+    ttl = ttl_until_rollover(trigger_date)
+    keys = {name: cache_key(name, query, payload["topk"], start_time, end_time) for name, _ in providers}
+    response = await search_cache.get_first(list(keys.values()), ttl)
+    if response is not None:
+        logger.info("Search cache hit. Returning %d results.", len(response))
+        return response
+
+    response, provider = await hedged_search(providers, payload)
     
     if not response:
         logger.warning("All configured search providers failed to return results.")
-        return ""
+        return []
+    await search_cache.set(keys[provider], response, ttl)
         
-    logger.info(f"Search successful. Returning {len(response)} results.")
-    return build_search_result_context(response)
+    logger.info("Search successful. Returning %d results.", len(response))
+    return response
+
+
+async def search_web(query: str, topk: int = 3, trigger_time: str = None):
+    """
+    Main tool function that orchestrates the search process with a fallback mechanism.
+    This tool's signature is compatible with the Pydantic model for LangChain.
+    """
+    return build_search_result_context(await search_web_results(query, topk, trigger_time))
 
 if __name__ == "__main__":
-    result = asyncio.run(search_web.ainvoke({"query": "最近电影", "topk": 3, "trigger_time": "2025-01-09 15:00:00"}))
+    result = asyncio.run(search_web("最近电影", 3, trigger_time="2025-01-09 15:00:00"))
     print(result)
+    print(search_stats())
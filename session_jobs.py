@@ -0,0 +1,79 @@
+"""
+In-process background job queue, serialized per key: jobs of one key (e.g. one chat session) run one at a time
+in submission order, jobs of different keys run concurrently. A job id that was already submitted is skipped,
+so a retried submission is a no-op.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable
+
+from bounded_cache import BoundedCache
+from logger import logger
+
+# how long shutdown waits for queued jobs before dropping them
+SESSION_JOBS_DRAIN_TIMEOUT = float(os.getenv("SESSION_JOBS_DRAIN_TIMEOUT", "30"))
+
+
+class SessionJobQueue:
+    def __init__(self, name: str, seen_ids: int = 100000):
+        self.name = name
+        self._queues = {}  # key -> deque of (job_id, job)
+        self._workers = {}  # key -> worker task, alive while the key has queued jobs
+        self._seen = BoundedCache(max_entries=seen_ids)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.duplicates = 0
+
+    def submit(self, key: Hashable, job_id: str, job: Callable[[], Awaitable[Any]]) -> bool:
+        """Queue job() after the key's earlier jobs; returns False if job_id was already submitted."""
+        if job_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.set(job_id, True)
+        self.submitted += 1
+        self._queues.setdefault(key, deque()).append((job_id, job))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._work(key))
+        return True
+
+    async def _work(self, key: Hashable):
+        queue = self._queues[key]
+        try:
+            while queue:
+                job_id, job = queue[0]
+                try:
+                    await job()
+                    self.completed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error("[SessionJobQueue] %s job %s failed: %r", self.name, job_id, e)
+                queue.popleft()
+        finally:
+            del self._queues[key]
+            del self._workers[key]
+
+    def pending(self, key: Hashable) -> int:
+        return len(self._queues.get(key, ()))
+
+    async def drain(self, timeout: float = SESSION_JOBS_DRAIN_TIMEOUT):
+        """Wait for the queued jobs, e.g. at shutdown."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        done, not_done = await asyncio.wait(workers, timeout=timeout)
+        if not_done:
+            logger.warning("[SessionJobQueue] %s: %d jobs dropped at shutdown", self.name, sum(self.pending(k) for k in self._queues))
+            for task in not_done:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "pending": sum(len(q) for q in self._queues.values()),
+            "active_keys": len(self._workers),
+        }
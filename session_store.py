@@ -0,0 +1,390 @@
+"""
+Async session storage for the chat graph.
+Redis (redis.asyncio, bounded connection pool) is the primary store, an embedded SQLite database is the fallback.
+What is written to SQLite while Redis is down is moved into Redis once it is back, before Redis is used again:
+log entries are appended, a session replaces the Redis copy unless that one was updated later.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Optional
+
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from dotenv import load_dotenv
+
+from resilience import CircuitOpenError, breaker
+from logger import logger
+from tracing import traced
+from sqlite_store import SESSION_DB_PATH, SqliteStore
+
+load_dotenv()
+
+# user fact / like-or-not logs: entries kept per user, entries read per prompt
+USER_LOG_MAX_ENTRIES = int(os.getenv("USER_LOG_MAX_ENTRIES", "200"))
+USER_LOG_READ_LIMIT = int(os.getenv("USER_LOG_READ_LIMIT", "20"))
+# sessions / log entries moved from SQLite to Redis per round trip after an outage
+SESSION_REPLAY_BATCH = int(os.getenv("SESSION_REPLAY_BATCH", "500"))
+
+# HSET the session unless the stored one was updated later; KEYS[1] session key, ARGV summary, history,
+# last_turn, updated_at
+_SET_SESSION_IF_NEWER = """
+local updated_at = tonumber(redis.call('HGET', KEYS[1], 'updated_at') or '0')
+if updated_at > tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'summary', ARGV[1], 'history', ARGV[2], 'last_turn', ARGV[3], 'updated_at', ARGV[4])
+return 1
+"""
+
+
+def _build_redis_client() -> aioredis.Redis:
+    # BlockingConnectionPool waits for a free connection instead of failing when the pool is exhausted
+    pool = aioredis.BlockingConnectionPool(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD") or None,
+        decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "64")),
+        timeout=float(os.getenv("REDIS_POOL_TIMEOUT", "2")),
+        socket_timeout=2,
+        socket_connect_timeout=2,
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+        retry=Retry(ExponentialBackoff(cap=0.5, base=0.05), 2),
+        retry_on_error=[RedisConnectionError, RedisTimeoutError],
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+class SessionStore:
+    """Non-blocking get/set/delete of user facts, feedback and session summary/history."""
+
+    def __init__(self):
+        self._redis = _build_redis_client()
+        self._breaker = breaker("redis")
+        self._sqlite = None
+        self._set_session_if_newer = self._redis.register_script(_SET_SESSION_IF_NEWER)
+        # SQLite may hold writes Redis has not seen, e.g. made by a process that ran while Redis was down
+        self._replay_needed = self._has_local()
+        self._replay_task = None
+
+    @property
+    def local(self) -> SqliteStore:
+        """The SQLite fallback, opened on first use so Redis-only deployments never touch the disk."""
+        if self._sqlite is None:
+            self._sqlite = SqliteStore()
+        return self._sqlite
+
+    def _has_local(self) -> bool:
+        return self._sqlite is not None or os.path.exists(SESSION_DB_PATH)
+
+    async def _client(self) -> Optional[aioredis.Redis]:
+        """
+        Return the Redis client while its breaker is closed; a half-open breaker is probed with a PING.
+        The writes that went to SQLite meanwhile are moved into Redis first, so Redis never serves older data.
+        """
+        if self._breaker.state != "closed":
+            try:
+                await self._breaker.call(self._redis.ping)
+            except CircuitOpenError:
+                return None
+            except Exception as e:
+                logger.warning("Redis still not available: %s", e)
+                return None
+            logger.info("Redis connected for summary storage.")
+        if self._replay_needed and self._replay_task is None:
+            self._replay_needed = False
+            self._replay_task = asyncio.create_task(self._replay_local())
+        if self._replay_task is not None:
+            # shielded: a cancelled request must not cancel the replay the other requests wait for
+            await asyncio.shield(self._replay_task)
+            if self._breaker.state != "closed":
+                return None
+        return self._redis
+
+    async def _replay_local(self):
+        """
+        Move the sessions and log entries written to SQLite into Redis. On a Redis error the batch is put back
+        and the replay runs again once Redis is back.
+        """
+        moved_sessions = moved_entries = 0
+        try:
+            while True:
+                sessions = await self.local.take_sessions(SESSION_REPLAY_BATCH)
+                try:
+                    if sessions:
+                        async with self._redis.pipeline(transaction=False) as pipe:
+                            for session in sessions:
+                                await self._set_session_if_newer(
+                                    keys=[self._session_key(session["user_id"], session["session_id"])],
+                                    args=[session["summary"], session["history"], session["last_turn"],
+                                          session["updated_at"]],
+                                    client=pipe)
+                            await self._breaker.call(pipe.execute, timeout=self._breaker.max_timeout)
+                except Exception as e:
+                    await self.local.restore_sessions(sessions)
+                    self._replay_needed = True
+                    self._mark_down(e, recorded=True)
+                    raise
+                entries = await self.local.take_user_log(SESSION_REPLAY_BATCH)
+                try:
+                    if entries:
+                        async with self._redis.pipeline(transaction=False) as pipe:
+                            for entry in entries:
+                                key = self._log_key(entry["kind"], entry["user_id"])
+                                pipe.rpush(key, json.dumps({"time": entry["time"], "text": entry["text"]},
+                                                           ensure_ascii=False))
+                                pipe.ltrim(key, -USER_LOG_MAX_ENTRIES, -1)
+                            await self._breaker.call(pipe.execute, timeout=self._breaker.max_timeout)
+                except Exception as e:
+                    await self.local.restore_user_log(entries)
+                    self._replay_needed = True
+                    self._mark_down(e, recorded=True)
+                    raise
+                moved_sessions += len(sessions)
+                moved_entries += len(entries)
+                if len(sessions) < SESSION_REPLAY_BATCH and len(entries) < SESSION_REPLAY_BATCH:
+                    break
+            if moved_sessions or moved_entries:
+                logger.info("[SessionStore] moved %d sessions and %d log entries from SQLite to Redis",
+                            moved_sessions, moved_entries)
+        except Exception as e:
+            logger.warning("[SessionStore] moving SQLite writes to Redis failed: %s", e)
+        finally:
+            self._replay_task = None
+
+    async def redis(self) -> Optional[aioredis.Redis]:
+        """The shared pooled Redis client if Redis is healthy, else None; for other modules' shared cache tiers."""
+        return await self._client()
+
+    def mark_down(self, e: Exception):
+        """Report a failed command on the client returned by redis()."""
+        self._mark_down(e)
+
+    def _mark_down(self, e: Exception, recorded: bool = False):
+        """Log the switch to SQLite; recorded: the failure was already counted by the breaker's call()."""
+        if recorded or self._breaker.state == "closed":
+            logger.warning("Redis not available, fallback to sqlite: %s", e)
+        if not recorded:
+            self._breaker.record_failure()
+
+    @staticmethod
+    def _log_key(kind: str, user_id: str) -> str:
+        return f"chat:log:{kind}:{user_id}"
+
+    @staticmethod
+    def _log_from_reply(raw_entries: list, legacy: Optional[str], limit: int) -> list:
+        entries = []
+        # Before the append-only log, all entries were concatenated into one string at chat:{kind}:{user_id}
+        if legacy:
+            entries.append({"time": "", "text": legacy})
+        for raw in raw_entries:
+            try:
+                entries.append(json.loads(raw))
+            except (TypeError, ValueError):
+                continue
+        return entries[-limit:]
+
+    async def _get_user_log_local(self, kind: str, user_id: str, limit: int) -> list:
+        if not self._has_local():
+            return []
+        try:
+            return await self.local.get_user_log(kind, user_id, limit)
+        except Exception as e:
+            logger.warning("[get_user_log] SQLite load error for %s:%s: %s", kind, user_id, e)
+        return []
+
+    @traced("store")
+    async def append_user_log(self, kind: str, user_id: str, text: str) -> dict:
+        """
+        O(1) append of a user fact / like-or-not entry; only the newest USER_LOG_MAX_ENTRIES are kept.
+
+        Args:
+            kind (str): "user_fact" or "user_like_ornot".
+            user_id (str): The user id.
+            text (str): The entry text.
+
+        Returns:
+            dict: The stored entry {"time", "text"}.
+        """
+        entry = {"time": time.asctime(time.localtime(time.time())), "text": text}
+        payload = json.dumps(entry, ensure_ascii=False)
+        client = await self._client()
+        if client is not None:
+            try:
+                key = self._log_key(kind, user_id)
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.rpush(key, payload)
+                    pipe.ltrim(key, -USER_LOG_MAX_ENTRIES, -1)
+                    await self._breaker.call(pipe.execute)
+                return entry
+            except Exception as e:
+                logger.warning("[append_user_log] Redis append error for %s:%s: %s", kind, user_id, e)
+                self._mark_down(e, recorded=True)
+        try:
+            await self.local.append_user_log(kind, user_id, entry, USER_LOG_MAX_ENTRIES)
+            self._replay_needed = True
+        except Exception as e:
+            logger.warning("[append_user_log] SQLite persist error for %s:%s: %s", kind, user_id, e)
+        return entry
+
+    @traced("store")
+    async def get_user_log(self, kind: str, user_id: str, limit: int = USER_LOG_READ_LIMIT) -> list:
+        """Return the newest `limit` entries of a user log, oldest first."""
+        client = await self._client()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.lrange(self._log_key(kind, user_id), -limit, -1)
+                    pipe.get(f"chat:{kind}:{user_id}")
+                    raw_entries, legacy = await self._breaker.call(pipe.execute)
+                if raw_entries or legacy:
+                    return self._log_from_reply(raw_entries, legacy, limit)
+            except Exception as e:
+                logger.warning("[get_user_log] Redis get error for %s:%s: %s", kind, user_id, e)
+                self._mark_down(e, recorded=True)
+        return await self._get_user_log_local(kind, user_id, limit)
+
+    @staticmethod
+    def _session_key(user_id: str, session_id: str) -> str:
+        return f"chat:session:{user_id}:{session_id}"
+
+    @staticmethod
+    def _legacy_session_keys(user_id: str, session_id: str) -> tuple:
+        # summary/history used to live in two string keys; still read so old sessions keep working
+        return f"chat:summary:{user_id}:{session_id}", f"chat:history:{user_id}:{session_id}"
+
+    async def _get_session_local(self, user_id: str, session_id: str) -> Optional[dict]:
+        if not self._has_local():
+            return None
+        try:
+            return await self.local.get_session(user_id, session_id)
+        except Exception as e:
+            logger.warning("[get_session] SQLite load error for %s:%s: %s", user_id, session_id, e)
+        return None
+
+    @staticmethod
+    def _session_from_reply(session_hash: dict, legacy_summary, legacy_history) -> Optional[dict]:
+        if session_hash:
+            return {"summary": session_hash.get("summary", ""), "history": session_hash.get("history", ""),
+                    "last_turn": session_hash.get("last_turn", "")}
+        if legacy_summary is not None:
+            return {"summary": legacy_summary, "history": legacy_history or "", "last_turn": ""}
+        return None
+
+    async def get_session(self, user_id: str, session_id: str) -> Optional[dict]:
+        """Return {"summary", "history", "last_turn"} for a session or None if nothing is stored."""
+        return (await self.load_session(user_id, session_id))["session"]
+
+    @traced("store")
+    async def load_session(self, user_id: str, session_id: str) -> dict:
+        """
+        Returns:
+            dict: {"session": {"summary", "history", "last_turn"} or None, "degraded": True when Redis could not be
+            read, so the session comes from SQLite only and may be missing what Redis holds}
+        """
+        client = await self._client()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(self._session_key(user_id, session_id))
+                    pipe.mget(*self._legacy_session_keys(user_id, session_id))
+                    session_hash, (legacy_summary, legacy_history) = await self._breaker.call(pipe.execute)
+                session = self._session_from_reply(session_hash, legacy_summary, legacy_history)
+                if session is None:
+                    session = await self._get_session_local(user_id, session_id)
+                return {"session": session, "degraded": False}
+            except Exception as e:
+                logger.warning("[get_session] Redis get error for %s:%s: %s", user_id, session_id, e)
+                self._mark_down(e, recorded=True)
+        return {"session": await self._get_session_local(user_id, session_id), "degraded": True}
+
+    @traced("store")
+    async def load_context(self, user_id: str, session_id: str, facts_limit: int = USER_LOG_READ_LIMIT) -> dict:
+        """
+        Hydrate everything a /query/ needs in one Redis round trip.
+
+        Returns:
+            dict: {"session": {"summary", "history", "last_turn"} or None, "user_facts": newest user fact entries,
+            "degraded": True when Redis could not be read (see load_session)}
+        """
+        client = await self._client()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(self._session_key(user_id, session_id))
+                    pipe.mget(*self._legacy_session_keys(user_id, session_id), f"chat:user_fact:{user_id}")
+                    pipe.lrange(self._log_key("user_fact", user_id), -facts_limit, -1)
+                    replies = await self._breaker.call(pipe.execute)
+                session_hash, (legacy_summary, legacy_history, legacy_fact), raw_facts = replies
+                session = self._session_from_reply(session_hash, legacy_summary, legacy_history)
+                if session is None:
+                    session = await self._get_session_local(user_id, session_id)
+                if raw_facts or legacy_fact:
+                    user_facts = self._log_from_reply(raw_facts, legacy_fact, facts_limit)
+                else:
+                    user_facts = await self._get_user_log_local("user_fact", user_id, facts_limit)
+                return {"session": session, "user_facts": user_facts, "degraded": False}
+            except Exception as e:
+                logger.warning("[load_context] Redis pipeline error for %s:%s: %s", user_id, session_id, e)
+                self._mark_down(e, recorded=True)
+        session, user_facts = await asyncio.gather(
+            self._get_session_local(user_id, session_id),
+            self._get_user_log_local("user_fact", user_id, facts_limit),
+        )
+        return {"session": session, "user_facts": user_facts, "degraded": True}
+
+    @traced("store")
+    async def set_session(self, user_id: str, session_id: str, summary: str, history: str, last_turn: str = ""):
+        """Store a session's summary/history; last_turn is the id of the newest turn folded into them."""
+        client = await self._client()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.hset(self._session_key(user_id, session_id),
+                              mapping={"summary": summary, "history": history, "last_turn": last_turn,
+                                       "updated_at": time.time()})
+                    pipe.delete(*self._legacy_session_keys(user_id, session_id))
+                    await self._breaker.call(pipe.execute)
+                return
+            except Exception as e:
+                logger.warning("[set_session] Redis set error for %s: %s", session_id, e)
+                self._mark_down(e, recorded=True)
+        try:
+            await self.local.set_session(user_id, session_id, summary, history, last_turn)
+            self._replay_needed = True
+        except Exception as e:
+            logger.warning("[set_session] SQLite persist error for %s:%s: %s", user_id, session_id, e)
+
+    @traced("store")
+    async def delete_session(self, user_id: str, session_id: str) -> dict:
+        result = {"redis": False, "sqlite": False}
+        client = await self._client()
+        if client is not None:
+            try:
+                await self._breaker.call(client.delete, self._session_key(user_id, session_id),
+                                         *self._legacy_session_keys(user_id, session_id))
+                result["redis"] = True
+            except Exception as e:
+                logger.warning("[delete_session] Redis delete error for %s:%s: %s", user_id, session_id, e)
+                self._mark_down(e, recorded=True)
+
+        if self._has_local():
+            try:
+                result["sqlite"] = await self.local.delete_session(user_id, session_id)
+            except Exception as e:
+                logger.warning("[delete_session] SQLite delete error for %s:%s: %s", user_id, session_id, e)
+        return result
+
+    async def close(self):
+        await self._redis.aclose()
+        if self._sqlite is not None:
+            await self._sqlite.close()
+
+
+session_store = SessionStore()
@@ -0,0 +1,260 @@
+"""
+Embedded SQLite (WAL) databases: the session store used when Redis is not available, and the graph checkpoints.
+All writes go through one writer thread that group-commits whatever is queued in a single transaction;
+reads run in worker threads on their own connections, so nothing blocks the event loop.
+"""
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from logger import logger
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "session_store.db")
+# max writes committed in one transaction
+SQLITE_WRITE_BATCH = int(os.getenv("SQLITE_WRITE_BATCH", "256"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    history TEXT NOT NULL DEFAULT '',
+    last_turn TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, session_id)
+);
+CREATE TABLE IF NOT EXISTS user_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    time TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_user_log ON user_log (kind, user_id, id);
+"""
+
+
+def _set_future(fut: asyncio.Future, result: Any, error: Optional[BaseException]):
+    if fut.done():
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+
+class SqliteDatabase:
+    """
+    One SQLite database with a group-committing writer thread.
+
+    Args:
+        path (str): Database file.
+        schema (str): Script creating the tables, run at startup.
+        name (str): Name of the writer thread.
+    """
+
+    def __init__(self, path: str, schema: str, name: str = "sqlite-store", batch_size: int = SQLITE_WRITE_BATCH):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(schema)
+        conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name=f"{name}-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # with WAL, NORMAL only risks the last transactions on power loss, never corruption
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    async def read(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run fn on this thread's read connection in a worker thread."""
+        return await asyncio.to_thread(lambda: fn(self._reader()))
+
+    async def write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run fn in the writer thread, inside the next group-committed transaction."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((fn, loop, fut))
+        return await fut
+
+    def _write_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit_batch(conn, batch)
+        conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list):
+        # One transaction for the whole batch; a savepoint per write so a failing write does not undo the others
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, _, _ in batch:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    outcomes.append((fn(conn), None))
+                    conn.execute("RELEASE write_op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_op")
+                    conn.execute("RELEASE write_op")
+                    outcomes.append((None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error("[SqliteDatabase] %s commit error, %d writes dropped: %r", self.path, len(batch), e)
+            try:
+                conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            outcomes = [(None, e)] * len(batch)
+        for (_, loop, fut), (result, error) in zip(batch, outcomes):
+            try:
+                loop.call_soon_threadsafe(_set_future, fut, result, error)
+            except RuntimeError:
+                # the event loop that queued the write is closed
+                pass
+
+    async def close(self):
+        self._queue.put(None)
+        await asyncio.to_thread(self._writer.join)
+
+
+class SqliteStore(SqliteDatabase):
+    """Sessions and capped user logs in one SQLite database."""
+
+    def __init__(self, path: str = SESSION_DB_PATH, batch_size: int = SQLITE_WRITE_BATCH):
+        super().__init__(path, _SCHEMA, name="sqlite-store", batch_size=batch_size)
+        conn = self._connect()
+        if "last_turn" not in [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]:
+            # databases created before sessions recorded their last applied turn
+            conn.execute("ALTER TABLE sessions ADD COLUMN last_turn TEXT NOT NULL DEFAULT ''")
+        conn.close()
+
+    async def get_session(self, user_id: str, session_id: str) -> Optional[dict]:
+        def _get(conn):
+            return conn.execute(
+                "SELECT summary, history, last_turn FROM sessions WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id),
+            ).fetchone()
+
+        row = await self.read(_get)
+        return {"summary": row[0], "history": row[1], "last_turn": row[2]} if row else None
+
+    async def set_session(self, user_id: str, session_id: str, summary: str, history: str, last_turn: str = ""):
+        def _set(conn):
+            conn.execute(
+                "INSERT INTO sessions (user_id, session_id, summary, history, last_turn, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, session_id) DO UPDATE SET "
+                "summary = excluded.summary, history = excluded.history, last_turn = excluded.last_turn, "
+                "updated_at = excluded.updated_at",
+                (user_id, session_id, summary, history, last_turn, time.time()),
+            )
+
+        await self.write(_set)
+
+    async def take_sessions(self, limit: int) -> list:
+        """Remove and return up to limit sessions, least recently updated first, to move them to Redis."""
+        def _take(conn):
+            rows = conn.execute(
+                "SELECT user_id, session_id, summary, history, last_turn, updated_at FROM sessions "
+                "ORDER BY updated_at LIMIT ?", (limit,)
+            ).fetchall()
+            conn.executemany("DELETE FROM sessions WHERE user_id = ? AND session_id = ? AND updated_at = ?",
+                             [(row[0], row[1], row[5]) for row in rows])
+            return rows
+
+        fields = ("user_id", "session_id", "summary", "history", "last_turn", "updated_at")
+        return [dict(zip(fields, row)) for row in await self.write(_take)]
+
+    async def restore_sessions(self, sessions: list):
+        """Put back sessions from take_sessions that could not be moved; a session written since is kept."""
+        def _restore(conn):
+            conn.executemany(
+                "INSERT OR IGNORE INTO sessions (user_id, session_id, summary, history, last_turn, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(s["user_id"], s["session_id"], s["summary"], s["history"], s["last_turn"], s["updated_at"])
+                 for s in sessions],
+            )
+
+        await self.write(_restore)
+
+    async def take_user_log(self, limit: int) -> list:
+        """Remove and return up to limit log entries of any kind and user, oldest first, to move them to Redis."""
+        def _take(conn):
+            rows = conn.execute(
+                "SELECT id, kind, user_id, time, text FROM user_log ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM user_log WHERE id <= ?", (rows[-1][0],))
+            return rows
+
+        return [{"kind": kind, "user_id": user_id, "time": t, "text": text}
+                for _, kind, user_id, t, text in await self.write(_take)]
+
+    async def restore_user_log(self, entries: list):
+        """Put back entries from take_user_log that could not be moved."""
+        def _restore(conn):
+            conn.executemany("INSERT INTO user_log (kind, user_id, time, text) VALUES (?, ?, ?, ?)",
+                             [(e["kind"], e["user_id"], e["time"], e["text"]) for e in entries])
+
+        await self.write(_restore)
+
+    async def delete_session(self, user_id: str, session_id: str) -> bool:
+        def _delete(conn):
+            cursor = conn.execute("DELETE FROM sessions WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+            return cursor.rowcount > 0
+
+        return await self.write(_delete)
+
+    async def append_user_log(self, kind: str, user_id: str, entry: dict, max_entries: int):
+        def _append(conn):
+            conn.execute(
+                "INSERT INTO user_log (kind, user_id, time, text) VALUES (?, ?, ?, ?)",
+                (kind, user_id, entry.get("time", ""), entry.get("text", "")),
+            )
+            # keep only the newest max_entries rows of this log
+            conn.execute(
+                "DELETE FROM user_log WHERE kind = ? AND user_id = ? AND id <= ("
+                "SELECT id FROM user_log WHERE kind = ? AND user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (kind, user_id, kind, user_id, max_entries),
+            )
+
+        await self.write(_append)
+
+    async def get_user_log(self, kind: str, user_id: str, limit: int) -> list:
+        def _get(conn):
+            return conn.execute(
+                "SELECT time, text FROM user_log WHERE kind = ? AND user_id = ? ORDER BY id DESC LIMIT ?",
+                (kind, user_id, limit),
+            ).fetchall()
+
+        rows = await self.read(_get)
+        return [{"time": t, "text": text} for t, text in reversed(rows)]
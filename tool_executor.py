@@ -0,0 +1,111 @@
+"""
+Tool execution layer around a ToolNode: the tool calls of one model turn run concurrently, each under a
+per-tool timeout and a per-tool concurrency limit shared by all requests of the worker.
+A call that times out becomes an error ToolMessage so the agent can still answer.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.prebuilt import ToolNode
+
+from logger import logger
+from tracing import LatencyHistogram, span
+
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "20"))
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "32"))
+
+
+def parse_overrides(value: str, cast) -> dict:
+    """'search_all=15,other_tool=8' -> {"search_all": 15.0, "other_tool": 8.0}"""
+    overrides = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, raw = item.split("=", 1)
+            overrides[name.strip()] = cast(raw.strip())
+    return overrides
+
+
+# per-tool overrides, e.g. TOOL_TIMEOUTS="search_all=15" TOOL_CONCURRENCY="search_all=16"
+TOOL_TIMEOUTS = parse_overrides(os.getenv("TOOL_TIMEOUTS", ""), float)
+TOOL_CONCURRENCY = parse_overrides(os.getenv("TOOL_CONCURRENCY", ""), int)
+
+
+class ToolExecutor:
+    """
+    Run a turn's tool calls through a ToolNode one call at a time, concurrently.
+
+    Args:
+        tool_node (ToolNode): Node holding the tools; also does state injection and error handling.
+        timeouts (dict): Per-tool timeout in seconds, TOOL_TIMEOUT for the others.
+        concurrency (dict): Per-tool limit of calls in flight, TOOL_MAX_CONCURRENCY for the others.
+    """
+
+    def __init__(self, tool_node: ToolNode, timeouts: Optional[Dict[str, float]] = None,
+                 concurrency: Optional[Dict[str, int]] = None):
+        self.tool_node = tool_node
+        self.timeouts = TOOL_TIMEOUTS if timeouts is None else timeouts
+        self.concurrency = TOOL_CONCURRENCY if concurrency is None else concurrency
+        self._semaphores = {}
+        self.histograms = {}
+        self.outcomes = {}  # tool -> {"ok", "error", "timeout"}
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.concurrency.get(name, TOOL_MAX_CONCURRENCY))
+        return self._semaphores[name]
+
+    async def ainvoke(self, state: dict, config: Optional[RunnableConfig] = None) -> dict:
+        tool_calls = state["messages"][-1].tool_calls
+        messages = await asyncio.gather(*(self._run_call(state, call, config) for call in tool_calls))
+        return {"messages": list(messages)}
+
+    async def _invoke_one(self, state: dict, call: dict, config: Optional[RunnableConfig]) -> ToolMessage:
+        # The ToolNode sees a state whose last message holds only this call
+        single_call_state = dict(state)
+        single_call_state["messages"] = state["messages"][:-1] + [AIMessage(content="", tool_calls=[call])]
+        async with self._semaphore(call["name"]):
+            output = await self.tool_node.ainvoke(single_call_state, config)
+        return output["messages"][0]
+
+    async def _run_call(self, state: dict, call: dict, config: Optional[RunnableConfig]) -> ToolMessage:
+        name = call["name"]
+        timeout = self.timeouts.get(name, TOOL_TIMEOUT)
+        outcomes = self.outcomes.setdefault(name, {"ok": 0, "error": 0, "timeout": 0})
+        start = time.perf_counter()
+        with span("tool", name) as tool_span:
+            try:
+                # the timeout also covers waiting for a concurrency slot
+                message = await asyncio.wait_for(self._invoke_one(state, call, config), timeout)
+                if getattr(message, "status", "success") == "error":
+                    outcomes["error"] += 1
+                    tool_span.status = "error"
+                else:
+                    outcomes["ok"] += 1
+            except asyncio.TimeoutError as e:
+                tool_span.fail(e, status="timeout")
+                outcomes["timeout"] += 1
+                logger.warning("[ToolExecutor] %s timed out after %ss", name, timeout)
+                message = ToolMessage(
+                    content=json.dumps({
+                        "error": "timeout",
+                        "tool": name,
+                        "timeout_seconds": timeout,
+                        "message": "The tool did not respond in time. Answer with the information you already have.",
+                    }, ensure_ascii=False),
+                    tool_call_id=call["id"],
+                    name=name,
+                    status="error",
+                )
+        self.histograms.setdefault(name, LatencyHistogram()).observe(time.perf_counter() - start)
+        return message
+
+    def stats(self) -> dict:
+        return {
+            name: {"outcomes": self.outcomes.get(name, {}), "latency": histogram.snapshot()}
+            for name, histogram in self.histograms.items()
+        }
@@ -0,0 +1,247 @@
+"""
+Per-request tracing and Prometheus metrics.
+
+span(kind, name) times one unit of work: a graph node, a model call, a tool call, a dependency call behind a
+circuit breaker or a store operation. Every span is recorded in the chat_span_duration_seconds histogram
+(labels kind, name, status) served by GET /metrics, and is added to the breakdown of the enclosing
+request_trace(), which is logged when the request took longer than TRACE_SLOW_REQUEST_SECONDS.
+
+When OTEL_EXPORTER_OTLP_ENDPOINT is set and the opentelemetry SDK and OTLP exporter are installed, spans are
+also exported to that collector, nested as they ran.
+"""
+import asyncio
+import bisect
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Optional
+
+from logger import logger
+
+TRACE_SLOW_REQUEST_SECONDS = float(os.getenv("TRACE_SLOW_REQUEST_SECONDS", "10"))
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "chat-agent")
+
+SPAN_METRIC = "chat_span_duration_seconds"
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets in seconds."""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+def _labels(labels: tuple, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text format.
+
+    Histograms and counters are created on first use per label set; gauges and histograms owned by other
+    modules are registered with a callback and read at scrape time.
+    """
+
+    def __init__(self):
+        self._help = {}  # name -> (type, help)
+        self._histograms = {}  # name -> {labels: LatencyHistogram}
+        self._counters = {}  # name -> {labels: float}
+        self._collectors = {}  # name -> callable returning {labels: value or LatencyHistogram}
+
+    def histogram(self, metric: str, help: str = "", /, **labels) -> LatencyHistogram:
+        self._help.setdefault(metric, ("histogram", help))
+        series = self._histograms.setdefault(metric, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = LatencyHistogram()
+        return histogram
+
+    def inc(self, metric: str, value: float = 1.0, help: str = "", /, **labels):
+        self._help.setdefault(metric, ("counter", help))
+        series = self._counters.setdefault(metric, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0.0) + value
+
+    def register(self, name: str, type_: str, help: str, collect: Callable[[], Dict[tuple, object]]):
+        """Serve a metric kept elsewhere; collect returns {((label, value), ...): number or LatencyHistogram}."""
+        self._help[name] = (type_, help)
+        self._collectors[name] = collect
+
+    def render(self) -> str:
+        lines = []
+        for name, (type_, help) in self._help.items():
+            if name in self._collectors:
+                try:
+                    series = self._collectors[name]()
+                except Exception as e:
+                    logger.warning("[metrics] collecting %s failed: %r", name, e)
+                    continue
+            else:
+                series = self._histograms.get(name) or self._counters.get(name) or {}
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type_}")
+            for labels, value in list(series.items()):
+                if isinstance(value, LatencyHistogram):
+                    cumulative = 0
+                    for bound, n in zip(list(value.buckets) + ["+Inf"], value.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {value.count}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def _init_otel():
+    if not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return None, None
+    try:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("[tracing] opentelemetry-sdk or the OTLP exporter is not installed, spans are not exported")
+        return None, None
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=OTEL_EXPORTER_OTLP_ENDPOINT)))
+    logger.info("[tracing] exporting spans to %s", OTEL_EXPORTER_OTLP_ENDPOINT)
+    return provider, provider.get_tracer("chat-agent")
+
+
+_otel_provider, _tracer = _init_otel()
+# (kind, name, seconds) of the spans of the current request
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class Span:
+    """A running span; attributes set on it are exported with the OpenTelemetry span."""
+
+    __slots__ = ("kind", "name", "status", "attributes", "otel")
+
+    def __init__(self, kind: str, name: str, attributes: dict):
+        self.kind = kind
+        self.name = name
+        self.status = "ok"
+        self.attributes = attributes
+        self.otel = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+        if self.otel is not None:
+            self.otel.set_attribute(key, value)
+
+    def fail(self, error: BaseException, status: str = "error"):
+        """Mark the span failed for an error that is handled inside it."""
+        self.status = status
+        if self.otel is not None:
+            self.otel.record_exception(error)
+            self.otel.set_attribute("error", True)
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes):
+    """
+    Time the enclosed block as a span.
+
+    Args:
+        kind (str): "request", "node", "llm", "tool", "dependency", "store" or "job".
+        name (str): What ran, e.g. the node, tool or breaker name.
+    """
+    current = Span(kind, name, attributes)
+    otel = _tracer.start_as_current_span(f"{kind} {name}", attributes={"kind": kind, **attributes}) \
+        if _tracer is not None else nullcontext()
+    start = time.perf_counter()
+    with otel as otel_span:
+        current.otel = otel_span
+        try:
+            yield current
+        except GeneratorExit:
+            current.status = "cancelled"
+            raise
+        except BaseException as e:
+            current.status = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.histogram(SPAN_METRIC, "Duration of traced units of work", kind=kind, name=name,
+                              status=current.status).observe(elapsed)
+            spans = _request_spans.get()
+            if spans is not None:
+                spans.append((kind, name, elapsed))
+
+
+def traced(kind: str, name: Optional[str] = None):
+    """Decorator running a coroutine function inside span(kind, name or its qualified name)."""
+    def decorate(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(kind, span_name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def request_trace(name: str, **attributes):
+    """Root span of a request; logs where the time went when the request was slow."""
+    spans = []
+    token = _request_spans.set(spans)
+    start = time.perf_counter()
+    try:
+        with span("request", name, **attributes) as current:
+            yield current
+    finally:
+        elapsed = time.perf_counter() - start
+        try:
+            _request_spans.reset(token)
+        except ValueError:
+            # closed from another context, e.g. a streaming response cancelled by the client
+            _request_spans.set(None)
+        if elapsed >= TRACE_SLOW_REQUEST_SECONDS:
+            breakdown = {}
+            for kind, span_name, seconds in spans:
+                if kind != "request":
+                    key = f"{kind}:{span_name}"
+                    breakdown[key] = breakdown.get(key, 0.0) + seconds
+            logger.info("[tracing] slow %s %s took %.2fs: %s", name, attributes, elapsed,
+                        ", ".join(f"{k}={v:.2f}s" for k, v in sorted(breakdown.items(), key=lambda kv: -kv[1])))
+
+
+def shutdown_tracing():
+    """Flush the spans waiting for export."""
+    if _otel_provider is not None:
+        _otel_provider.shutdown()
@@ -40,7 +40,7 @@ def azure_openai():
         azure_deployment="gpt-4o",
         openai_api_version="2024-05-01-preview"
     )
-    logger.info(f"LLM Initiating azure_openai model")
+    logger.info("LLM Initiating azure_openai model")
     return llm
 
 def gemini_openai():
@@ -50,7 +50,7 @@ def gemini_openai():
         max_retries=2,
         api_key=os.environ["GEMINI_API_KEY"] #os.getenv("GEMINI_API_KEY"),
     )
-    logger.info(f"LLM Initiating gemini_openai model")
+    logger.info("LLM Initiating gemini_openai model")
     return llm
 
 def qwen_turbo():
@@ -67,18 +67,19 @@ def qwen_turbo():
     model_plus = ChatTongyi(
         #model="deepseek-v3.2-exp", # You can also try "qwen-max", "qwen-turbo", etc.
         model="qwen-plus",
-        streaming=False,
+        # token deltas reach the /query/ stream as they are generated
+        streaming=True,
         temperature=0.0
     )
     
     model_turbo = ChatTongyi(
         model="qwen-turbo",
-        streaming=False,
+        streaming=True,
         temperature=0.0
     )
 
 
-    logger.info(f"LLM Initiating qwen_turbo model")
+    logger.info("LLM Initiating qwen_turbo model")
     return model_plus, model_turbo
 
 def openai_gpt():
@@ -86,7 +87,7 @@ def openai_gpt():
     # 确保使用支持视觉的模型
     model = 'gpt-4o'  
     llm = init_chat_model(model, model_provider=provider,temperature=0.7)
-    logger.info(f"LLM Initiating openai_gpt model")
+    logger.info("LLM Initiating openai_gpt model")
     return llm
 
 
@@ -99,6 +100,24 @@ def init_model():
     llm_plus, llm_turbo = qwen_turbo()
     return llm_plus, llm_turbo
 
+# Providers for the model router's roles; a single-model provider fills both roles
+MODEL_PROVIDERS = {
+    "qwen": qwen_turbo,
+    "azure": azure_openai,
+    "openai": openai_gpt,
+    "gemini": gemini_openai,
+}
+
+def init_models(provider: str = None) -> dict:
+    """Models by router role ("strong": final answers, "fast": summaries and light tasks), from MODEL_PROVIDER."""
+    provider = provider or os.getenv("MODEL_PROVIDER", "qwen")
+    models = MODEL_PROVIDERS[provider]()
+    if isinstance(models, tuple):
+        strong, fast = models
+    else:
+        strong = fast = models
+    return {"strong": strong, "fast": fast}
+
 def handle_tool_error(state) -> dict:
     error = state.get("error")
     tool_calls = state["messages"][-1].tool_calls